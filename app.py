@@ -1,37 +1,90 @@
-from framework import WebFramework, FileSystemSessionInterface
-from werkzeug.wrappers import Response
+from framework import WebFramework, FileSystemSessionInterface, RateLimit, ConcurrencyLimit
+from serialization import JSONResponse, dumps
 from werkzeug.exceptions import NotFound, Unauthorized
 from schemas import (
     UserSchema, LoginResponseSchema, LogoutResponseSchema,
-    ProfileResponseSchema, CreateUserResponseSchema,
+    ProfileResponseSchema, CreateUserResponseSchema, LoginRequestSchema,
     ErrorSchema, HelloResponseSchema
 )
 from security import (
     hash_password, verify_password, create_access_token,
-    create_refresh_token, token_required, generate_csrf_token,
-    verify_csrf_token, RateLimiter
+    create_refresh_token, token_required, generate_csrf_nonce,
+    generate_csrf_token, verify_csrf_token, verify_token, load_user, CSRF_NONCE_COOKIE,
+    SharedMemoryRateLimiter, SQLiteRateLimiter
 )
-from models import User, init_db, get_db
+from models import (
+    User, init_db, configure_database, SessionLocal, SQLInstrumentation,
+    get_user_by_username, find_user_by_username, find_user_conflicts, user_cache
+)
+from sqlalchemy.exc import IntegrityError
 import json
 import time
 import os
+import signal
+import logging
 
 app = WebFramework()
 
+# 访问日志由后台线程批量写入，不阻塞请求
+app.enable_access_log(path=os.getenv('ACCESS_LOG'))
+
+# 过载时快速失败：最多同时处理 64 个请求，排队超过 0.5 秒返回 503，处理变慢时自动降低上限
+app.concurrency_limit(ConcurrencyLimit(64, max_queue_wait=0.5, adaptive=True, target_latency=1.0))
+
+# 请求默认 30 秒超时，客户端可以通过 X-Request-Timeout 缩短
+app.default_timeout = float(os.getenv('REQUEST_TIMEOUT', 30))
+
 # 配置会话接口
 app.session_interface = FileSystemSessionInterface()
 
-# 创建速率限制器
-login_limiter = RateLimiter(max_requests=5, time_window=300)  # 5分钟内最多5次尝试
+# 按用户限流时从令牌解析当前用户
+app.user_loader = load_user
 
-# 初始化数据库
+# 创建速率限制器，计数在所有 worker 进程间共享
+try:
+    login_limiter = SharedMemoryRateLimiter(max_requests=5, time_window=300, name='login',  # 5分钟内最多5次尝试
+                                            namespace=os.path.dirname(os.path.abspath(__file__)))
+except (RuntimeError, OSError):
+    login_limiter = SQLiteRateLimiter(max_requests=5, time_window=300)
+
+# 初始化数据库，请求内通过 request.db 使用请求级会话
+configure_database(pool_size=10, max_overflow=20, pool_timeout=10)
+app.use_database(SessionLocal)
 init_db()
 
+# 统计每个请求的 SQL 次数和耗时，调试模式下输出 Server-Timing 响应头
+sql_instrumentation = SQLInstrumentation().init_app(app)
+
+# 采样的请求中为每条 SQL 语句创建 span，采样率由 WFRAME_TRACE_SAMPLE_RATE 控制
+app.tracer.instrument_sqlalchemy()
+
+# 请求耗时等指标由框架在 /metrics 输出，这里补充用户缓存和 SQL 汇总
+app.metrics.register_callback(
+    'wframe_user_cache_hit_ratio', '用户缓存命中率', lambda: user_cache.stats()['hit_rate'])
+app.metrics.register_callback(
+    'wframe_db_queries_total', '按路由统计的 SQL 语句数',
+    lambda: {(('endpoint', endpoint),): route['queries']
+             for endpoint, route in sql_instrumentation.route_stats().items()},
+    type='counter')
+
+# 审计和通知在响应发送之后由后台线程执行
+audit_logger = logging.getLogger('wframe.audit')
+
+def audit(event, username, **details):
+    """记录审计事件"""
+    audit_logger.info(json.dumps({'event': event, 'username': username, 'time': time.time(), **details},
+                                 ensure_ascii=False))
+
+def send_welcome_notification(username, email):
+    """发送欢迎通知（示例中仅记录日志）"""
+    audit_logger.info('向 %s <%s> 发送欢迎通知', username, email)
+
 # 创建初始管理员用户
 def create_admin_user():
-    db = next(get_db())
-    admin = db.query(User).filter(User.username == 'admin').first()
-    if not admin:
+    db = SessionLocal()
+    try:
+        if find_user_by_username(db, 'admin'):
+            return
         admin = User(
             username='admin',
             password=hash_password('admin123'),
@@ -39,16 +92,12 @@ def create_admin_user():
         )
         db.add(admin)
         db.commit()
-        print("\n=== 初始用户信息 ===")
-        print("用户名: admin")
-        print("密码: admin123")
-        print("==================\n")
-
-# 日志中间件
-def logger_middleware(request):
-    start_time = time.time()
-    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {request.method} {request.path}")
-    return request
+    finally:
+        db.close()
+    print("\n=== 初始用户信息 ===")
+    print("用户名: admin")
+    print("密码: admin123")
+    print("==================\n")
 
 # CSRF 中间件
 def csrf_middleware(request):
@@ -58,163 +107,138 @@ def csrf_middleware(request):
         
     if request.method in ['POST', 'PUT', 'DELETE']:
         csrf_token = request.headers.get('X-CSRF-Token')
-        stored_token = request.session.data.get('csrf_token')
+        nonce = request.cookies.get(CSRF_NONCE_COOKIE)
         
-        if not csrf_token or not stored_token or not verify_csrf_token(csrf_token, stored_token):
-            return Response(
-                json.dumps({'error': 'CSRF 验证失败'}, ensure_ascii=False),
-                status=403,
-                mimetype='application/json'
-            )
+        if not verify_csrf_token(csrf_token, nonce, app.secret_key):
+            return JSONResponse(CSRF_FAILED_BODY, 403)
     return request
 
-# 性能监控中间件
-def performance_middleware(request):
-    start_time = time.time()
-    response = request
-    if isinstance(response, Response):
-        process_time = time.time() - start_time
-        print(f"请求处理时间: {process_time:.3f}秒")
-    return response
-
 # 注册中间件
-app.use(logger_middleware)
 app.use(csrf_middleware)
-app.use(performance_middleware)
 
-# 错误处理器
+# 错误处理器，固定的响应体在启动时编码一次
+NOT_FOUND_BODY = dumps({'error': '页面未找到', 'code': 404})
+UNAUTHORIZED_BODY = dumps({'error': '未授权访问', 'code': 401})
+TOO_MANY_REQUESTS_BODY = dumps({'error': '请求过于频繁，请稍后再试', 'code': 429})
+SERVICE_UNAVAILABLE_BODY = dumps({'error': '服务繁忙，请稍后再试', 'code': 503})
+GATEWAY_TIMEOUT_BODY = dumps({'error': '请求处理超时', 'code': 504})
+INTERNAL_ERROR_BODY = dumps({'error': '服务器内部错误', 'code': 500})
+CSRF_FAILED_BODY = dumps({'error': 'CSRF 验证失败'})
+
 @app.errorhandler(404)
 def not_found(error):
     """处理404错误"""
-    return Response(
-        json.dumps({
-            'error': '页面未找到',
-            'code': 404
-        }, ensure_ascii=False),
-        status=404,
-        mimetype='application/json'
-    )
+    return JSONResponse(NOT_FOUND_BODY, 404)
 
 @app.errorhandler(401)
 def unauthorized(error):
     """处理401错误"""
-    return Response(
-        json.dumps({
-            'error': '未授权访问',
-            'code': 401
-        }, ensure_ascii=False),
-        status=401,
-        mimetype='application/json'
-    )
+    return JSONResponse(UNAUTHORIZED_BODY, 401)
+
+@app.errorhandler(429)
+def too_many_requests(error):
+    """处理429错误"""
+    return JSONResponse(TOO_MANY_REQUESTS_BODY, 429)
+
+@app.errorhandler(503)
+def service_unavailable(error):
+    """处理503错误"""
+    return JSONResponse(SERVICE_UNAVAILABLE_BODY, 503)
+
+@app.errorhandler(504)
+def gateway_timeout(error):
+    """处理504错误"""
+    return JSONResponse(GATEWAY_TIMEOUT_BODY, 504)
 
 @app.errorhandler(500)
 def internal_error(error):
     """处理500错误"""
-    return Response(
-        json.dumps({
-            'error': '服务器内部错误',
-            'code': 500
-        }, ensure_ascii=False),
-        status=500,
-        mimetype='application/json'
-    )
+    return JSONResponse(INTERNAL_ERROR_BODY, 500)
 
 @app.route('/')
 def index(request):
     """首页"""
-    # 生成 CSRF 令牌
-    csrf_token = generate_csrf_token()
-    request.session.data['csrf_token'] = csrf_token
-    request.session.modified = True
+    # 生成无状态 CSRF 令牌，随机数保存在 cookie 中，不写会话
+    nonce = request.cookies.get(CSRF_NONCE_COOKIE)
+    new_nonce = not nonce
+    if new_nonce:
+        nonce = generate_csrf_nonce()
+    csrf_token = generate_csrf_token(nonce, app.secret_key)
     
-    return Response(
-        json.dumps({
-            'message': '欢迎使用我们的Web框架！',
-            'csrf_token': csrf_token
-        }, ensure_ascii=False),
-        mimetype='application/json'
-    )
+    response = JSONResponse({
+        'message': '欢迎使用我们的Web框架！',
+        'csrf_token': csrf_token
+    })
+    if new_nonce:
+        response.set_cookie(CSRF_NONCE_COOKIE, nonce, httponly=True, samesite='Lax')
+    return response
 
 @app.route('/api/hello/<name>', schema=HelloResponseSchema)
 def hello(request, name):
     """发送问候消息"""
-    data = {
+    # 返回普通数据，由框架按 HelloResponseSchema 序列化
+    return {
         'message': f'你好, {name}!',
         'status': 'success'
     }
-    return Response(
-        json.dumps(data, ensure_ascii=False),
-        mimetype='application/json'
-    )
 
-@app.route('/api/users', methods=['POST'], schema=CreateUserResponseSchema)
+@app.route('/api/users', methods=['POST'], schema=CreateUserResponseSchema, request_schema=UserSchema)
 def create_user(request):
     """创建新用户"""
-    data = json.loads(request.get_data())
+    data = request.validated
     username = data.get('username')
     password = data.get('password')
     email = data.get('email')
     
-    db = next(get_db())
-    if db.query(User).filter(User.username == username).first():
-        return Response(
-            json.dumps({'error': '用户名已存在'}, ensure_ascii=False),
-            status=400,
-            mimetype='application/json'
-        )
+    # 一次查询同时检查用户名和邮箱
+    conflicts = find_user_conflicts(request.db, username, email)
+    if 'username' in conflicts:
+        return JSONResponse({'error': '用户名已存在'}, 400)
     
-    if email and db.query(User).filter(User.email == email).first():
-        return Response(
-            json.dumps({'error': '邮箱已被使用'}, ensure_ascii=False),
-            status=400,
-            mimetype='application/json'
-        )
+    if 'email' in conflicts:
+        return JSONResponse({'error': '邮箱已被使用'}, 400)
     
+    # 结束查询开启的读事务，避免在 bcrypt 计算期间持有旧快照，插入时再开启新事务
+    request.db.commit()
     hashed_password = hash_password(password)
-    user = User(
-        username=username,
-        password=hashed_password,
-        email=email
-    )
     
-    db.add(user)
-    db.commit()
+    # 提交成功后再发布事件和登记后台任务，唯一约束冲突（并发注册同名用户）时返回 400
+    try:
+        request.db.add(User(
+            username=username,
+            password=hashed_password,
+            email=email
+        ))
+        request.db.commit()
+    except IntegrityError:
+        request.db.rollback()
+        return JSONResponse({'error': '用户名或邮箱已存在'}, 400)
     
-    return Response(
-        json.dumps({
-            'message': '用户创建成功',
-            'username': username
-        }, ensure_ascii=False),
-        mimetype='application/json'
-    )
+    request.defer(audit, 'user_created', username)
+    app.events.publish('users', {'username': username}, event='user_created')
+    request.defer(send_welcome_notification, username, email)
+    return {
+        'message': '用户创建成功',
+        'username': username
+    }
 
-@app.route('/api/login', methods=['POST'], schema=LoginResponseSchema)
+@app.route('/api/login', methods=['POST'], schema=LoginResponseSchema, request_schema=LoginRequestSchema,
+           limit=RateLimit(login_limiter, key='ip'),
+           # bcrypt 校验占满 CPU，同时最多按 CPU 核数并发
+           concurrency=ConcurrencyLimit(os.cpu_count() or 1, max_queue_wait=2.0))
 def login(request):
     """用户登录"""
-    # 检查登录尝试次数
-    client_ip = request.remote_addr
-    if not login_limiter.is_allowed(client_ip):
-        return Response(
-            json.dumps({
-                'error': '登录尝试次数过多，请稍后再试'
-            }, ensure_ascii=False),
-            status=429,
-            mimetype='application/json'
-        )
+    username = request.validated['username']
+    password = request.validated['password']
     
-    data = json.loads(request.get_data())
-    username = data.get('username')
-    password = data.get('password')
+    # 鉴权直接读取数据库：用户缓存按进程独立，其他 worker 修改的密码或账户状态在缓存中可能仍是旧值
+    user = find_user_by_username(request.db, username)
     
-    db = next(get_db())
-    user = db.query(User).filter(User.username == username).first()
+    if not user or not user.is_active or not verify_password(password, user.password):
+        request.defer(audit, 'login_failed', username, remote_addr=request.remote_addr)
+        return JSONResponse({'error': '用户名或密码错误'}, 401)
     
-    if not user or not verify_password(password, user.password):
-        return Response(
-            json.dumps({'error': '用户名或密码错误'}, ensure_ascii=False),
-            status=401,
-            mimetype='application/json'
-        )
+    request.defer(audit, 'login', username, remote_addr=request.remote_addr)
     
     # 创建访问令牌和刷新令牌
     access_token = create_access_token({'username': username})
@@ -224,41 +248,25 @@ def login(request):
     request.session.data['refresh_token'] = refresh_token
     request.session.modified = True
     
-    return Response(
-        json.dumps({
-            'message': '登录成功',
-            'access_token': access_token,
-            'refresh_token': refresh_token
-        }, ensure_ascii=False),
-        mimetype='application/json'
-    )
+    return {
+        'message': '登录成功',
+        'access_token': access_token,
+        'refresh_token': refresh_token
+    }
 
 @app.route('/api/refresh', methods=['POST'])
 def refresh_token(request):
     """刷新访问令牌"""
     refresh_token = request.session.data.get('refresh_token')
     if not refresh_token:
-        return Response(
-            json.dumps({'error': '无效的刷新令牌'}, ensure_ascii=False),
-            status=401,
-            mimetype='application/json'
-        )
+        return JSONResponse({'error': '无效的刷新令牌'}, 401)
     
     try:
         payload = verify_token(refresh_token)
         access_token = create_access_token({'username': payload['username']})
-        return Response(
-            json.dumps({
-                'access_token': access_token
-            }, ensure_ascii=False),
-            mimetype='application/json'
-        )
+        return JSONResponse({'access_token': access_token})
     except ValueError as e:
-        return Response(
-            json.dumps({'error': str(e)}, ensure_ascii=False),
-            status=401,
-            mimetype='application/json'
-        )
+        return JSONResponse({'error': str(e)}, 401)
 
 @app.route('/api/logout', schema=LogoutResponseSchema)
 @token_required
@@ -266,35 +274,104 @@ def logout(request):
     """用户退出登录"""
     request.session.data.clear()
     request.session.modified = True
-    return Response(
-        json.dumps({'message': '已退出登录'}, ensure_ascii=False),
-        mimetype='application/json'
-    )
+    return {'message': '已退出登录'}
 
 @app.route('/api/profile', schema=ProfileResponseSchema)
 @token_required
 def profile(request):
     """获取用户信息"""
     username = request.user.get('username')
-    db = next(get_db())
-    user = db.query(User).filter(User.username == username).first()
+    user = get_user_by_username(request.db, username)
     
     if not user:
-        return Response(
-            json.dumps({'error': '用户不存在'}, ensure_ascii=False),
-            status=404,
-            mimetype='application/json'
-        )
+        return JSONResponse({'error': '用户不存在'}, 404)
     
-    return Response(
-        json.dumps({
-            'username': user.username,
-            'email': user.email,
-            'created_at': user.created_at.isoformat(),
-            'message': '获取用户信息成功'
-        }, ensure_ascii=False),
-        mimetype='application/json'
+    return {
+        'username': user.username,
+        'email': user.email,
+        'created_at': user.created_at,
+        'message': '获取用户信息成功'
+    }
+
+@app.route('/api/events')
+def events(request):
+    """用户相关事件流（Server-Sent Events），替代轮询
+
+    需要登录。浏览器的 EventSource 无法设置请求头，令牌也可以通过 ?access_token= 传递。
+    """
+    user = load_user(request)
+    if user is None and request.args.get('access_token'):
+        try:
+            user = verify_token(request.args['access_token'])
+        except ValueError:
+            user = None
+    if user is None:
+        return JSONResponse({'error': '缺少或无效的认证令牌'}, 401)
+    return app.event_stream(request, 'users', retry=3000)
+
+# 上传的文件按内容的 sha256 命名保存
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'uploads')
+
+@app.route('/api/files', methods=['POST'])
+@token_required
+def upload_files(request):
+    """上传文件，请求体流式解析，单个文件最大 10 MB"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    files = []
+    for part in request.iter_parts(max_part_size=10 * 1024 * 1024, max_total_size=50 * 1024 * 1024):
+        if not part.is_file:
+            continue
+        part.save(os.path.join(UPLOAD_DIR, part.checksum))
+        files.append({
+            'name': part.name,
+            'filename': part.filename,
+            'size': part.size,
+            'sha256': part.checksum
+        })
+        part.close()
+    return {'files': files}
+
+def admin_forbidden(request):
+    """非管理员返回 403 响应"""
+    if request.user.get('username') != 'admin':
+        return JSONResponse({'error': '需要管理员权限'}, 403)
+    return None
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST'])
+@token_required
+def profiler_admin(request):
+    """查看或切换采样分析器，POST {"action": "start" | "stop"}"""
+    forbidden = admin_forbidden(request)
+    if forbidden:
+        return forbidden
+    
+    result = {}
+    if request.method == 'POST':
+        action = json.loads(request.get_data() or b'{}').get('action')
+        if action == 'start':
+            app.profiler.start()
+        elif action == 'stop':
+            result['files'] = app.profiler.stop()
+    result.update(app.profiler.status())
+    return JSONResponse(result)
+
+@app.route('/api/admin/traces')
+@token_required
+def traces_admin(request):
+    """查看最近的追踪，支持 ?trace_id= 和 ?limit="""
+    forbidden = admin_forbidden(request)
+    if forbidden:
+        return forbidden
+    
+    traces = app.tracer.exporter.traces(
+        limit=request.args.get('limit', 50, type=int),
+        trace_id=request.args.get('trace_id')
     )
+    return JSONResponse({'traces': traces})
+
+# kill -USR2 <pid> 也可以切换采样分析器
+if hasattr(signal, 'SIGUSR2'):
+    app.profiler.install_signal(signal.SIGUSR2)
 
 if __name__ == '__main__':
     create_admin_user()
@@ -0,0 +1,142 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger('wframe.background')
+
+class TaskQueueFull(RuntimeError):
+    """后台任务队列已满"""
+
+class _Task:
+    __slots__ = ('fn', 'args', 'kwargs', 'retries', 'attempt')
+
+    def __init__(self, fn, args, kwargs, retries):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.retries = retries
+        self.attempt = 0
+
+class BackgroundTasks:
+    """有界后台任务线程池
+
+    submit 在队列满时最多阻塞 put_timeout 秒（对提交方形成反压），仍然满则抛出 TaskQueueFull。
+    失败的任务按 backoff * 2^n（带随机抖动，最长 max_backoff 秒）延迟重试 retries 次。
+    任务不继承提交方的上下文变量，请求的截止时间等不会影响后台任务。
+    """
+    def __init__(self, workers=4, maxsize=1000, retries=0, backoff=0.5, max_backoff=30.0, put_timeout=1.0):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self._threads = []
+        self._timers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'wframe-background-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args, retries=None, **kwargs):
+        """提交任务 fn(*args, **kwargs)"""
+        if self._closed:
+            raise RuntimeError('后台任务池已关闭')
+        if not self._threads:
+            self._start()
+        task = _Task(fn, args, kwargs, self.retries if retries is None else retries)
+        try:
+            self.queue.put(task, timeout=self.put_timeout)
+        except queue.Full:
+            self.rejected += 1
+            raise TaskQueueFull(f'后台任务队列已满（{self.queue.maxsize}）') from None
+        self.submitted += 1
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                self._execute(task)
+            finally:
+                self.queue.task_done()
+
+    def _execute(self, task):
+        try:
+            task.fn(*task.args, **task.kwargs)
+        except Exception:
+            if task.attempt < task.retries:
+                self._schedule_retry(task)
+            else:
+                self.failed += 1
+                logger.exception('后台任务 %r 执行失败（共尝试 %d 次）', task.fn, task.attempt + 1)
+        else:
+            self.completed += 1
+
+    def _schedule_retry(self, task):
+        delay = min(self.max_backoff, self.backoff * 2 ** task.attempt) * random.uniform(0.5, 1.0)
+        task.attempt += 1
+        self.retried += 1
+
+        def requeue():
+            try:
+                self.queue.put(task, timeout=self.put_timeout)
+            except queue.Full:
+                self.failed += 1
+                logger.error('后台任务 %r 重试时队列已满，已放弃', task.fn)
+            finally:
+                # 放回队列之后才移除，shutdown 据此等待重试任务入队
+                with self._lock:
+                    self._timers.discard(timer)
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        with self._lock:
+            self._timers.add(timer)
+        timer.start()
+
+    def depth(self):
+        """等待执行的任务数"""
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self, timeout=None):
+        """停止接收新任务，等待已排队的任务（包括等待中的重试）执行完毕后停止工作线程"""
+        if self._closed:
+            return
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            with self._lock:
+                pending_retries = bool(self._timers)
+            if not pending_retries and self.queue.unfinished_tasks == 0:
+                break
+            time.sleep(0.01)
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
@@ -0,0 +1,76 @@
+"""响应格式基准测试
+
+对 app.py 中典型的响应数据，比较 JSON（标准库和 serialization.dumps）、MessagePack、CBOR
+编码后的大小以及编码、解码耗时。MessagePack 和 CBOR 只在安装了 msgpack / cbor2 时测试。
+
+用法: python benchmarks/format_bench.py [--iterations 5000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialization import FORMATS, compile_schema, orjson
+from json_bench import ItemListSchema, make_payload
+
+def make_payloads():
+    """与框架实际发送的数据一致：schema 路由的返回值先经过编译后的 dump 函数"""
+    return {
+        'hello': {'message': '你好, world!', 'status': 'success'},
+        'login': {
+            'message': '登录成功',
+            'access_token': 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.' + 'a' * 120,
+            'refresh_token': 'eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.' + 'b' * 120,
+        },
+        'profile': {
+            'username': 'admin',
+            'email': 'admin@example.com',
+            'created_at': '2024-01-01T12:00:00.123456',
+            'message': '获取用户信息成功',
+        },
+        'items_100': compile_schema(ItemListSchema)(make_payload(100)),
+    }
+
+def make_formats():
+    formats = {'json (stdlib)': (
+        lambda data: json.dumps(data, ensure_ascii=False).encode('utf-8'),
+        json.loads,
+    )}
+    formats['json (orjson)' if orjson else 'json (fast)'] = FORMATS['application/json']
+    for mimetype in ('application/msgpack', 'application/cbor'):
+        if mimetype in FORMATS:
+            formats[mimetype.split('/')[1]] = FORMATS[mimetype]
+    return formats
+
+def measure(fn, arg, iterations):
+    for _ in range(min(100, iterations)):
+        fn(arg)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    formats = make_formats()
+    missing = [name for name in ('msgpack', 'cbor') if name not in formats]
+    if missing:
+        print(f'未安装: {", ".join(missing)}（pip install wframe[msgpack] / wframe[cbor]）', file=sys.stderr)
+
+    for name, payload in make_payloads().items():
+        print(f'\n{name}')
+        print(f'{"format":16s} {"size":>8s} {"encode":>10s} {"decode":>10s}')
+        for format_name, (encode, decode) in formats.items():
+            body = encode(payload)
+            encode_us = measure(encode, payload, args.iterations)
+            decode_us = measure(decode, body, args.iterations)
+            print(f'{format_name:16s} {len(body):7d}B {encode_us:8.2f}µs {decode_us:8.2f}µs')
+
+if __name__ == '__main__':
+    main()
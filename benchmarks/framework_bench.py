@@ -0,0 +1,200 @@
+"""WebFramework 微基准测试
+
+在进程内直接调用 WSGI 接口（不经过网络），测量路由分发、中间件链、文件会话读写、
+JWT 校验、限流、OpenAPI 生成和 JSON 响应构建的单次耗时。
+--save 把结果保存为基线；--check 与基线比较，p50 变慢超过阈值时以非零状态退出。
+
+用法: python benchmarks/framework_bench.py [--iterations 5000] [--baseline FILE] [--save | --check] [--threshold 0.2]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from marshmallow import Schema, fields
+from werkzeug.test import EnvironBuilder
+from framework import WebFramework, FileSystemSessionInterface, Request, Response, Session
+from security import RateLimiter, create_access_token, token_required
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'framework_baseline.json')
+
+class ItemSchema(Schema):
+    id = fields.Int()
+    name = fields.Str()
+    tags = fields.List(fields.Str())
+
+def make_app(middlewares=0):
+    app = WebFramework()
+    app.metrics_path = None
+
+    @app.route('/')
+    def index(request):
+        return Response('ok')
+
+    @app.route('/api/items/<int:item_id>', schema=ItemSchema)
+    def item(request, item_id):
+        return Response('ok')
+
+    @app.route('/api/profile')
+    @token_required
+    def profile(request):
+        return Response('ok')
+
+    for i in range(20):
+        app.route(f'/api/resource{i}/<name>', endpoint=f'resource{i}', schema=ItemSchema)(lambda request, name: Response(name))
+
+    for _ in range(middlewares):
+        app.use(lambda request: request)
+    return app
+
+def wsgi_call(app, environ):
+    """调用 WSGI 接口并读完响应体"""
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+    body = app(dict(environ, **{'wsgi.input': io.BytesIO()}), start_response)
+    for _ in body:
+        pass
+    if hasattr(body, 'close'):
+        body.close()
+
+def build_cases(workdir):
+    app = make_app()
+    chain_app = make_app(middlewares=10)
+    token = create_access_token({'username': 'bench'})
+    item_environ = EnvironBuilder(path='/api/items/42').get_environ()
+    profile_environ = EnvironBuilder(path='/api/profile', headers={'Authorization': f'Bearer {token}'}).get_environ()
+
+    def dispatch():
+        request = Request(item_environ)
+        app.dispatch_request(request)
+
+    sessions = FileSystemSessionInterface(os.path.join(workdir, 'sessions'))
+    session = Session({'user_id': 1, 'username': 'bench'})
+    session.modified = True
+    saved = Response('ok')
+    sessions.save_session(app, session, saved)
+    sid = saved.headers['Set-Cookie'].split('session_id=')[1].split(';')[0]
+    session_environ = EnvironBuilder(path='/', headers={'Cookie': f'session_id={sid}'}).get_environ()
+
+    def session_open():
+        sessions.open_session(app, Request(session_environ))
+
+    def session_save():
+        sessions.save_session(app, session, Response('ok'))
+
+    limiter = RateLimiter(max_requests=100, time_window=60)
+    keys = [f'client-{i}' for i in range(1000)]
+    counter = iter(range(10 ** 12))
+
+    def rate_limit():
+        limiter.is_allowed(keys[next(counter) % 1000])
+
+    def openapi():
+        json.dumps(app.spec.to_dict())
+
+    payload = {'items': [{'id': i, 'name': f'item {i}', 'tags': ['a', 'b']} for i in range(20)]}
+
+    def json_response():
+        Response(json.dumps(payload, ensure_ascii=False), mimetype='application/json').get_data()
+
+    return [
+        ('dispatch_request', dispatch),
+        ('wsgi_request', lambda: wsgi_call(app, item_environ)),
+        ('middleware_chain_10', lambda: wsgi_call(chain_app, item_environ)),
+        ('session_open', session_open),
+        ('session_save', session_save),
+        ('token_required', lambda: wsgi_call(app, profile_environ)),
+        ('rate_limiter', rate_limit),
+        ('openapi_render', openapi),
+        ('json_response', json_response),
+    ]
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    clock = time.perf_counter_ns
+    started = clock()
+    for _ in range(iterations):
+        t0 = clock()
+        fn()
+        timings.append(clock() - t0)
+    total = clock() - started
+    timings.sort()
+
+    def pct(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))] / 1000
+
+    return {
+        'ops_per_sec': iterations / (total / 1e9),
+        'p50_us': pct(0.50),
+        'p90_us': pct(0.90),
+        'p99_us': pct(0.99),
+    }
+
+def compare(results, baseline, threshold):
+    """返回 p50 变慢超过阈值的用例"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['p50_us'] / base['p50_us']
+        if ratio > 1 + threshold:
+            regressions.append((name, base['p50_us'], result['p50_us'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--only', help='只运行名称包含该字符串的用例')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的 p50 变慢比例')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--save', action='store_true', help='把本次结果保存为基线')
+    group.add_argument('--check', action='store_true', help='与基线比较，回退时返回非零状态')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, fn in build_cases(workdir):
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(fn, args.iterations, args.warmup)
+            if not args.json:
+                r = results[name]
+                print(f'{name:22s} {r["ops_per_sec"]:10.0f} ops/s  '
+                      f'p50 {r["p50_us"]:8.1f}µs  p90 {r["p90_us"]:8.1f}µs  p99 {r["p99_us"]:8.1f}µs')
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'基线已保存到 {args.baseline}', file=sys.stderr)
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            sys.exit(f'基线文件不存在: {args.baseline}，请先使用 --save 生成')
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f'性能回退: {name} p50 {before:.1f}µs -> {after:.1f}µs (+{(ratio - 1) * 100:.0f}%)', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print('未发现超过阈值的性能回退', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
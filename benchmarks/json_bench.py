@@ -0,0 +1,85 @@
+"""JSON 序列化基准测试
+
+比较 marshmallow schema.dump + json.dumps（原来的写法）、编译后的 dump 函数 + json.dumps、
+编译后的 dump 函数 + serialization.dumps（安装了 orjson 时使用 orjson）三种方式。
+
+用法: python benchmarks/json_bench.py [--items 100] [--iterations 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from marshmallow import Schema, fields
+from serialization import compile_schema, dumps, orjson
+
+class OwnerSchema(Schema):
+    id = fields.Int()
+    username = fields.Str()
+    email = fields.Str()
+
+class ItemSchema(Schema):
+    id = fields.Int()
+    name = fields.Str()
+    price = fields.Float()
+    active = fields.Bool()
+    created_at = fields.DateTime()
+    tags = fields.List(fields.Str())
+    owner = fields.Nested(OwnerSchema)
+
+class ItemListSchema(Schema):
+    items = fields.List(fields.Nested(ItemSchema))
+    total = fields.Int()
+
+def make_payload(count):
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    return {
+        'items': [{
+            'id': i,
+            'name': f'商品 {i}',
+            'price': i * 1.5,
+            'active': i % 2 == 0,
+            'created_at': now,
+            'tags': ['新品', 'sale', f'tag{i % 7}'],
+            'owner': {'id': i % 10, 'username': f'user{i % 10}', 'email': f'user{i % 10}@example.com'},
+        } for i in range(count)],
+        'total': count,
+    }
+
+def measure(fn, iterations):
+    for _ in range(min(100, iterations)):
+        fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=100, help='响应中的条目数')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    payload = make_payload(args.items)
+    schema = ItemListSchema()
+    dump = compile_schema(ItemListSchema)
+    assert dump(payload) == schema.dump(payload)
+
+    cases = [
+        ('marshmallow + json', lambda: json.dumps(schema.dump(payload), ensure_ascii=False).encode('utf-8')),
+        ('compiled + json', lambda: json.dumps(dump(payload), ensure_ascii=False).encode('utf-8')),
+        (f'compiled + {"orjson" if orjson else "json"}', lambda: dumps(dump(payload))),
+    ]
+    print(f'{args.items} 个条目，{args.iterations} 次')
+    baseline = None
+    for name, fn in cases:
+        seconds = measure(fn, args.iterations)
+        baseline = baseline or seconds
+        print(f'{name:20s} {seconds * 1e6:10.1f}µs  {1 / seconds:8.0f} ops/s  x{baseline / seconds:.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""User 查询单次调用开销基准测试
+
+对比 ORM Query 写法与 models 中缓存的 lambda 语句。
+用法: python benchmarks/user_query_bench.py [--calls 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+from models import (
+    Base, User, create_db_engine,
+    find_user_by_username, find_user_by_id, find_user_conflicts
+)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_db_engine(f'sqlite:///{os.path.join(workdir, "bench.db")}')
+        Base.metadata.create_all(engine)
+        db = sessionmaker(bind=engine)()
+        db.add_all([
+            User(username=f'user{i}', password='x', email=f'user{i}@example.com')
+            for i in range(1000)
+        ])
+        db.commit()
+
+        def query_username():
+            return db.query(User).filter(User.username == 'user500').first()
+
+        def query_id():
+            return db.query(User).filter(User.id == 500).first()
+
+        def query_two_selects():
+            return (db.query(User).filter(User.username == 'new').first(),
+                    db.query(User).filter(User.email == 'new@example.com').first())
+
+        cases = [
+            ('按用户名 Query', query_username),
+            ('按用户名 lambda', lambda: find_user_by_username(db, 'user500')),
+            ('按 id Query', query_id),
+            ('按 id lambda', lambda: find_user_by_id(db, 500)),
+            ('唯一性检查 两次 SELECT', query_two_selects),
+            ('唯一性检查 单次查询', lambda: find_user_conflicts(db, 'new', 'new@example.com')),
+        ]
+        for name, fn in cases:
+            fn()
+            elapsed = timeit.timeit(fn, number=args.calls)
+            print(f'{name:24s} {elapsed / args.calls * 1e6:8.1f} µs/次')
+        db.close()
+        engine.dispose()
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,16 @@ def build():
         'framework.py',
         'security.py',
         'models.py',
-        'cli.py'
+        'cli.py',
+        'metrics.py',
+        'accesslog.py',
+        'profiler.py',
+        'tracing.py',
+        'deadlines.py',
+        'background.py',
+        'serialization.py',
+        'uploads.py',
+        'events.py'
     ]
     
     for file in files_to_copy:
@@ -26,6 +35,7 @@ def build():
     # 创建 __init__.py
     with open('wframe/__init__.py', 'w', encoding='utf-8') as f:
         f.write('''from .framework import WebFramework, Response
+from .serialization import JSONResponse
 from .security import token_required
 from .models import User, get_db
 
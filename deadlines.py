@@ -0,0 +1,31 @@
+import contextvars
+import time
+
+class DeadlineExceeded(TimeoutError):
+    """请求截止时间已过"""
+
+# 当前请求的截止时间（time.monotonic() 时刻），由框架在请求开始时设置
+_deadline = contextvars.ContextVar('wframe_deadline', default=None)
+
+def set_deadline(deadline):
+    """设置当前上下文的截止时间，返回用于 reset_deadline 的令牌"""
+    return _deadline.set(deadline)
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+def get_deadline():
+    return _deadline.get()
+
+def remaining_time():
+    """剩余时间（秒），未设置截止时间时返回 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+def check_deadline():
+    """截止时间已过时抛出 DeadlineExceeded，适合在长循环中调用"""
+    deadline = _deadline.get()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded('请求已超过截止时间')
@@ -0,0 +1,196 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+from werkzeug.wrappers import Response
+
+try:
+    from .serialization import dumps
+except ImportError:
+    from serialization import dumps
+
+def format_event(data, event=None, id=None, retry=None):
+    """编码一个 SSE 帧，data 不是 str/bytes 时编码为 JSON"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    elif not isinstance(data, bytes):
+        data = dumps(data)
+    lines = []
+    if id is not None:
+        lines.append(b'id: %d' % id)
+    if event is not None:
+        lines.append(b'event: ' + event.encode('utf-8'))
+    if retry is not None:
+        lines.append(b'retry: %d' % retry)
+    lines.extend(b'data: ' + line for line in data.splitlines() or [b''])
+    return b'\n'.join(lines) + b'\n\n'
+
+class Event:
+    __slots__ = ('id', 'channel', 'event', 'data', 'frame')
+
+    def __init__(self, id, channel, event, data):
+        self.id = id
+        self.channel = channel
+        self.event = event
+        self.data = data
+        # 同一事件发给所有订阅者，只编码一次
+        self.frame = format_event(data, event, id)
+
+class Subscription:
+    """一个连接的订阅，事件放入有界队列；队列满时（客户端读取太慢）断开连接，由客户端带 Last-Event-ID 重连补发"""
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = channels
+        self.maxsize = maxsize
+        self.queue = deque()
+        self.closed = False
+        self.overflowed = False
+        self._cond = threading.Condition()
+
+    def _push(self, event):
+        """放入事件，队列已满时关闭订阅并返回 False"""
+        with self._cond:
+            if self.closed:
+                return True
+            if len(self.queue) >= self.maxsize:
+                self.overflowed = self.closed = True
+                self._cond.notify()
+                return False
+            self.queue.append(event)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """取出下一个事件，超时返回 None；订阅关闭（或因读取太慢被断开）后抛出 StopIteration"""
+        with self._cond:
+            if not self.queue and not self.closed:
+                self._cond.wait(timeout)
+            if self.overflowed or (self.closed and not self.queue):
+                raise StopIteration
+            return self.queue.popleft() if self.queue else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        self.broker._unsubscribe(self)
+
+class EventBroker:
+    """进程内发布/订阅
+
+    事件 ID 在整个 broker 内单调递增，每个频道保留最近 replay_size 条事件，
+    订阅时按 Last-Event-ID 补发；请求的 ID 早于保留范围，或大于已发布的最大 ID（例如进程重启后 ID 从头计数）时，
+    先发送 reset 事件，通知客户端重新加载完整状态。
+    多 worker 部署时每个进程各有一个 broker，需要由外部消息系统把事件发布到所有进程。
+    """
+    def __init__(self, replay_size=1000, queue_size=100):
+        self.replay_size = replay_size
+        self.queue_size = queue_size
+        self.published = 0
+        self.last_id = 0
+        self.dropped_connections = 0
+        self._ids = itertools.count(1)
+        self._buffers = {}
+        self._evicted = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, data, event=None):
+        """发布事件，从不阻塞，返回事件 ID"""
+        with self._lock:
+            item = Event(next(self._ids), channel, event, data)
+            self.last_id = item.id
+            buffer = self._buffers.get(channel)
+            if buffer is None:
+                buffer = self._buffers[channel] = deque(maxlen=self.replay_size)
+            if len(buffer) == buffer.maxlen:
+                self._evicted[channel] = buffer[0].id
+            buffer.append(item)
+            subscribers = list(self._subscribers.get(channel, ()))
+            self.published += 1
+        for subscription in subscribers:
+            if not subscription._push(item):
+                self.dropped_connections += 1
+                self._unsubscribe(subscription)
+        return item.id
+
+    def subscribe(self, *channels, last_event_id=None, queue_size=None):
+        """订阅一个或多个频道，last_event_id 之后的已保留事件先放入队列"""
+        subscription = Subscription(self, channels, queue_size or self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                missed = []
+                # 客户端的 ID 来自重启之前的 broker，中间的事件已无法补发
+                ahead = last_event_id > self.last_id
+                for channel in channels:
+                    if ahead or self._evicted.get(channel, 0) > last_event_id:
+                        subscription.queue.append(Event(None, channel, 'reset', ''))
+                    missed.extend(e for e in self._buffers.get(channel, ()) if e.id > last_event_id)
+                missed.sort(key=lambda e: e.id)
+                # 补发的事件不受队列大小限制，数量最多为 replay_size * 频道数
+                subscription.queue.extend(missed)
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None and subscription in subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def connections(self):
+        """当前订阅数"""
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+    def stats(self):
+        return {
+            'connections': self.connections(),
+            'channels': len(self._buffers),
+            'published': self.published,
+            'dropped_connections': self.dropped_connections,
+        }
+
+    def close(self):
+        """关闭所有订阅，正在进行的事件流随之结束"""
+        with self._lock:
+            subscriptions = {s for subscribers in self._subscribers.values() for s in subscribers}
+        for subscription in subscriptions:
+            subscription.close()
+
+class EventStreamResponse(Response):
+    """text/event-stream 响应
+
+    没有事件时每隔 heartbeat 秒发送一个注释帧，既防止代理断开空闲连接，也能及时发现已断开的客户端；
+    连接关闭时自动取消订阅。每个连接在等待时只占用一个线程（或在 gevent 等协程服务器下占用一个协程）。
+    """
+    def __init__(self, subscription, heartbeat=15.0, retry=None, **kwargs):
+        super().__init__(self._stream(subscription, heartbeat, retry), mimetype='text/event-stream', **kwargs)
+        # 事件流没有开始迭代（例如 HEAD 请求）时也要取消订阅
+        self.call_on_close(subscription.close)
+        self.headers['Cache-Control'] = 'no-cache'
+        self.headers['X-Accel-Buffering'] = 'no'  # 关闭 nginx 缓冲
+
+    @staticmethod
+    def _stream(subscription, heartbeat, retry):
+        try:
+            yield b': connected\n' + (b'retry: %d\n' % retry if retry is not None else b'') + b'\n'
+            last_write = time.monotonic()
+            while True:
+                try:
+                    event = subscription.get(timeout=max(0.0, heartbeat - (time.monotonic() - last_write)))
+                except StopIteration:
+                    return
+                if event is not None:
+                    yield event.frame
+                    last_write = time.monotonic()
+                elif time.monotonic() - last_write >= heartbeat:
+                    yield b': ping\n\n'
+                    last_write = time.monotonic()
+        finally:
+            subscription.close()
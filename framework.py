@@ -1,10 +1,15 @@
-from werkzeug.wrappers import Request, Response
+from werkzeug.wrappers import Request as BaseRequest, Response
 from werkzeug.routing import Map, Rule
 from werkzeug.serving import run_simple
-from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.exceptions import (
+    HTTPException, BadRequest, NotFound, RequestEntityTooLarge, TooManyRequests, ServiceUnavailable,
+    GatewayTimeout, default_exceptions
+)
 from werkzeug.middleware.shared_data import SharedDataMiddleware
+from werkzeug.wsgi import ClosingIterator
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
+from marshmallow import ValidationError
 import json
 import time
 import functools
@@ -13,20 +18,299 @@ import pickle
 from datetime import datetime, timedelta
 import importlib.resources
 import importlib.metadata
+import math
+import uuid
+import threading
+import atexit
+import logging
+from types import SimpleNamespace
+
+try:
+    from .metrics import MetricsRegistry
+    from .accesslog import AccessLogger
+    from .profiler import SamplingProfiler
+    from .tracing import Tracer, RingBufferExporter, NULL_SPAN
+    from .deadlines import DeadlineExceeded, set_deadline, reset_deadline
+    from .background import BackgroundTasks, TaskQueueFull
+    from .serialization import JSONResponse, JSON_MIMETYPE, FORMATS, compile_schema, dumps, loads
+    from .uploads import MultipartReader
+    from .events import EventBroker, EventStreamResponse
+except ImportError:
+    from metrics import MetricsRegistry
+    from accesslog import AccessLogger
+    from profiler import SamplingProfiler
+    from tracing import Tracer, RingBufferExporter, NULL_SPAN
+    from deadlines import DeadlineExceeded, set_deadline, reset_deadline
+    from background import BackgroundTasks, TaskQueueFull
+    from serialization import JSONResponse, JSON_MIMETYPE, FORMATS, compile_schema, dumps, loads
+    from uploads import MultipartReader
+    from events import EventBroker, EventStreamResponse
+
+logger = logging.getLogger('wframe')
+
+@functools.lru_cache(maxsize=256)
+def _error_body(message, code):
+    """默认错误响应体，相同的错误只编码一次"""
+    return dumps({'error': message, 'code': code})
+
+# 预先编码 werkzeug 内置 HTTP 错误的默认响应体
+for _code, _exception in default_exceptions.items():
+    _error_body(str(_exception()), _code)
+
+class RequestValidationError(BadRequest):
+    """请求数据未通过 request_schema 校验，errors 为 marshmallow 的错误信息"""
+    def __init__(self, errors):
+        super().__init__('请求数据校验失败')
+        self.errors = errors
 
 class Session:
     def __init__(self, data=None):
         self.data = data or {}
         self.modified = False
 
+class Request(BaseRequest):
+    """框架请求对象，附带路由匹配结果和请求级数据库会话"""
+    endpoint = None
+    view_args = None
+    routing_exception = None
+    user = None
+    db_session_factory = None
+    db_checkout_time = 0.0
+    _db = None
+    trace_id = None
+    start_time = None
+    deadline = None
+    _request_id = None
+    _deferred = None
+    validated = None
+    _payload = Ellipsis
+    _uploads = None
+    
+    # get_json 使用 serialization.loads（安装了 orjson 时更快），结果按请求缓存
+    json_module = SimpleNamespace(loads=loads, dumps=json.dumps)
+
+    def on_json_loading_failed(self, e):
+        raise BadRequest('请求体不是有效的 JSON')
+
+    def get_payload(self):
+        """按 Content-Type 解析请求体，支持 JSON 以及已安装对应库的 MessagePack/CBOR，其他类型按 JSON 解析"""
+        codec = FORMATS.get(self.mimetype)
+        if codec is None or self.mimetype == JSON_MIMETYPE:
+            return self.get_json(force=True)
+        if self._payload is Ellipsis:
+            try:
+                self._payload = codec[1](self.get_data())
+            except Exception:
+                raise BadRequest(f'请求体不是有效的 {self.mimetype}') from None
+        return self._payload
+
+    def defer(self, fn, *args, **kwargs):
+        """登记在响应发送完成后由后台线程池执行的任务"""
+        if self._deferred is None:
+            self._deferred = []
+        self._deferred.append((fn, args, kwargs))
+
+    def remaining(self):
+        """距截止时间的剩余秒数，未设置超时时返回 None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def iter_body(self, chunk_size=64 * 1024, limit=None):
+        """分块读取请求体，不在内存中缓存；超过 limit 字节时抛出 413"""
+        if limit is not None and self.content_length is not None and self.content_length > limit:
+            raise RequestEntityTooLarge(f'请求体超过 {limit} 字节')
+        stream = self.stream
+        total = 0
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            total += len(chunk)
+            if limit is not None and total > limit:
+                raise RequestEntityTooLarge(f'请求体超过 {limit} 字节')
+            yield chunk
+
+    def iter_parts(self, **options):
+        """流式解析 multipart/form-data 请求体，返回逐个产出 UploadedPart 的迭代器（选项见 MultipartReader）
+
+        临时文件在响应发送完毕后自动关闭。
+        """
+        reader = MultipartReader(self, **options)
+        if self._uploads is None:
+            self._uploads = []
+        self._uploads.append(reader)
+        return reader
+
+    def close(self):
+        """关闭上传文件和 iter_parts 创建的临时文件"""
+        super().close()
+        for reader in self._uploads or ():
+            reader.close()
+
+    @property
+    def request_id(self):
+        """请求 ID，优先使用客户端传入的 X-Request-ID，其次是 traceparent 中的追踪 ID"""
+        if self._request_id is None:
+            self._request_id = self.headers.get('X-Request-ID') or self.trace_id or uuid.uuid4().hex
+        return self._request_id
+
+    @property
+    def db(self):
+        """请求级数据库会话，首次访问时创建，请求结束时由框架提交或回滚并关闭"""
+        if self._db is None:
+            if self.db_session_factory is None:
+                raise RuntimeError('未配置数据库，请先调用 app.use_database()')
+            self._db = self.db_session_factory()
+        return self._db
+
+class RateLimit:
+    """声明式限流策略
+
+    limiter 为任意提供 check(key) 方法的限流器（见 security 模块），
+    key 可以是 'ip'、'user'、'route'，或接收 request 并返回键的函数；
+    键为 None 时该策略不生效，例如未登录请求上的按用户限流。
+    """
+    def __init__(self, limiter, key='ip', scope=None):
+        self.limiter = limiter
+        self.key = key
+        self.scope = scope
+
+    def key_for(self, app, request):
+        """计算请求对应的限流键"""
+        if callable(self.key):
+            return self.key(request)
+        if self.key == 'ip':
+            return request.remote_addr or 'unknown'
+        if self.key == 'route':
+            return request.endpoint
+        if self.key == 'user':
+            user = app.load_user(request)
+            if isinstance(user, dict):
+                return user.get('username')
+            return getattr(user, 'username', user)
+        raise ValueError(f'未知的限流键类型: {self.key}')
+
+class ConcurrencyLimit:
+    """并发限制策略
+
+    同时处理的请求数达到上限时，新请求最多排队等待 max_queue_wait 秒，仍无空位则直接返回 503。
+    adaptive 为 True 时按 AIMD 调整上限：处理耗时超过 target_latency 时乘以 backoff 降低上限
+    （每个耗时周期最多一次），上限被用满且耗时正常时每轮加一，最高不超过 max_in_flight。
+    """
+    def __init__(self, max_in_flight, max_queue_wait=0.0, adaptive=False, target_latency=0.5,
+                 min_limit=1, backoff=0.9, retry_after=1):
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.retry_after = retry_after
+        self.limit = float(max_in_flight)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, max_wait=None):
+        """占用一个名额，排队超时返回 False；max_wait 进一步限制等待时间，例如请求的剩余时间"""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            wait = self.max_queue_wait if max_wait is None else min(self.max_queue_wait, max_wait)
+            if wait <= 0:
+                return False
+            deadline = time.monotonic() + wait
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None):
+        """释放名额，latency 为本次处理耗时，用于自适应调整"""
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if self.adaptive and latency is not None:
+                self._adjust(latency, saturated)
+            self._cond.notify()
+
+    def _adjust(self, latency, saturated):
+        if latency > self.target_latency:
+            now = time.monotonic()
+            if now - self._last_decrease >= latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        elif saturated:
+            self.limit = min(self.max_in_flight, self.limit + 1 / self.limit)
+
 class WebFramework:
     def __init__(self):
         self.url_map = Map()
         self.endpoints = {}
         self.middlewares = []
         self.error_handlers = {}
-        self.secret_key = os.urandom(24)
+        self.secret_key = os.getenv('SECRET_KEY', '').encode('utf-8')
+        if not self.secret_key:
+            # 随机密钥只在本进程有效，多 worker 部署时各进程签发的 CSRF 令牌和会话互不承认
+            logger.warning('未设置 SECRET_KEY，使用随机密钥；多 worker 部署时必须通过环境变量设置')
+            self.secret_key = os.urandom(24)
         self.session_interface = None
+        self.rate_limits = []
+        self.route_limits = {}
+        self.concurrency_limits = []
+        self.route_concurrency = {}
+        self.default_timeout = None
+        self.route_timeouts = {}
+        self.route_dumpers = {}
+        self.route_validators = {}
+        self.route_body_limits = {}
+        self.max_body_size = 1024 * 1024  # request_schema 路由的请求体上限（字节）
+        self.timeout_header = 'X-Request-Timeout'
+        self.user_loader = None
+        self.db_session_factory = None
+        self.before_request_funcs = []
+        self.after_request_funcs = []
+        self.debug = False
+        
+        # 内置 Prometheus 指标，设置 WFRAME_METRICS_DIR 后在多个 worker 进程间聚合
+        self.metrics_path = '/metrics'
+        self.metrics = MetricsRegistry(multiprocess_dir=os.getenv('WFRAME_METRICS_DIR'))
+        self._init_metrics()
+        self.access_log = None
+        
+        # 后台任务线程池，进程退出时执行完已排队的任务
+        self.background_tasks = BackgroundTasks(workers=int(os.getenv('WFRAME_BACKGROUND_WORKERS', 4)))
+        atexit.register(self.background_tasks.shutdown, timeout=30)
+        self.metrics.register_callback(
+            'wframe_background_queue_depth', '等待执行的后台任务数', self.background_tasks.depth)
+        self.metrics.register_callback(
+            'wframe_background_tasks_total', '按状态统计的后台任务数',
+            lambda: {(('state', state),): value for state, value in self.background_tasks.stats().items()
+                     if state != 'depth'},
+            type='counter')
+        
+        # 进程内事件发布/订阅，供 Server-Sent Events 路由使用；进程退出时结束所有事件流
+        self.events = EventBroker()
+        atexit.register(self.events.close)
+        self.metrics.register_callback(
+            'wframe_sse_connections', '当前 SSE 连接数', self.events.connections)
+        self.metrics.register_callback(
+            'wframe_sse_dropped_connections_total', '因读取太慢被断开的 SSE 连接数',
+            lambda: self.events.dropped_connections, type='counter')
+        
+        # 采样分析器，默认关闭，通过 app.profiler.start()/stop()、信号或管理接口切换
+        self.profiler = SamplingProfiler(self, output_dir=os.getenv('WFRAME_PROFILE_DIR', 'profiles'))
+        
+        # 请求追踪，默认不采样；带 traceparent 的请求沿用上游的采样决定
+        self.tracer = Tracer(
+            sample_rate=float(os.getenv('WFRAME_TRACE_SAMPLE_RATE', '0')),
+            exporter=RingBufferExporter()
+        )
         
         # 初始化 OpenAPI 文档
         self.spec = APISpec(
@@ -48,6 +332,39 @@ class WebFramework:
             '/static': self._get_static_path()
         })
         
+    def _init_metrics(self):
+        metrics = self.metrics
+        self.requests_total = metrics.counter(
+            'wframe_http_requests_total', '按路由、方法和状态码统计的请求数', ('endpoint', 'method', 'status'))
+        self.request_duration = metrics.histogram(
+            'wframe_http_request_duration_seconds', '请求处理耗时', ('endpoint', 'method'))
+        self.requests_in_flight = metrics.gauge(
+            'wframe_http_requests_in_flight', '正在处理的请求数')
+        self.session_duration = metrics.histogram(
+            'wframe_session_duration_seconds', '会话存储读写耗时', ('operation',))
+        self.db_checkout_duration = metrics.histogram(
+            'wframe_db_checkout_duration_seconds', '请求等待数据库连接的耗时', ('endpoint',))
+        self.db_query_duration = metrics.histogram(
+            'wframe_db_query_duration_seconds', '每个请求的 SQL 执行总耗时', ('endpoint',))
+        self.request_timeouts = metrics.counter(
+            'wframe_http_request_timeouts_total', '超过截止时间返回 504 的请求数', ('endpoint',))
+        self.requests_shed = metrics.counter(
+            'wframe_http_requests_shed_total', '因并发限制被拒绝的请求数', ('endpoint', 'reason'))
+        metrics.register_callback(
+            'wframe_concurrency_limit', '当前并发上限（自适应模式下会变化）',
+            lambda: {(('scope', scope),): policy.limit for scope, policy in self._concurrency_policies()})
+        # 访问日志指标在这里注册一次，采集时读取当前的 access_log，未启用时为 0
+        self._closed_access_log_dropped = 0
+        self._closed_access_log_sampled_out = 0
+        metrics.register_callback(
+            'wframe_access_log_dropped_total', '队列已满而丢弃的访问日志数',
+            lambda: self._closed_access_log_dropped + (self.access_log.dropped if self.access_log else 0),
+            type='counter')
+        metrics.register_callback(
+            'wframe_access_log_sampled_out_total', '积压时被采样丢弃的访问日志数',
+            lambda: self._closed_access_log_sampled_out + (self.access_log.sampled_out if self.access_log else 0),
+            type='counter')
+        
     def _get_static_path(self):
         """获取静态文件路径"""
         try:
@@ -62,19 +379,141 @@ class WebFramework:
         self.middlewares.append(middleware)
         return self
         
+    def before_request(self, f):
+        """注册请求开始时的回调 f(request)，在路由匹配之后、限流之前执行"""
+        self.before_request_funcs.append(f)
+        return f
+        
+    def after_request(self, f):
+        """注册请求结束时的回调 f(request, response)，返回（可替换的）响应"""
+        self.after_request_funcs.append(f)
+        return f
+        
+    def use_database(self, session_factory):
+        """配置请求级数据库会话工厂，处理函数通过 request.db 使用"""
+        self.db_session_factory = session_factory
+        return self
+        
+    def enable_access_log(self, **options):
+        """启用异步访问日志，参数见 AccessLogger"""
+        # 重复调用时关闭之前的日志线程，其计数并入已关闭的累计值，计数器保持单调
+        previous = self.access_log
+        if previous is not None:
+            previous.close()
+            self._closed_access_log_dropped += previous.dropped
+            self._closed_access_log_sampled_out += previous.sampled_out
+        self.access_log = AccessLogger(**options)
+        return self.access_log
+        
+    def background(self, fn, *args, **kwargs):
+        """立即把任务提交到后台线程池，队列满时短暂阻塞后抛出 TaskQueueFull"""
+        self.background_tasks.submit(fn, *args, **kwargs)
+        
+    def run_deferred(self, request):
+        """提交请求登记的后台任务，在响应体写完后调用"""
+        for fn, args, kwargs in request._deferred:
+            try:
+                self.background_tasks.submit(fn, *args, **kwargs)
+            except TaskQueueFull:
+                logger.error('后台任务队列已满，丢弃任务 %r', fn)
+        
+    def event_stream(self, request, *channels, heartbeat=15.0, retry=None):
+        """返回订阅 channels 的 Server-Sent Events 响应，按 Last-Event-ID 请求头（或 ?last_event_id=）补发错过的事件
+
+        处理函数返回后请求即结束（并发名额、数据库会话都已释放），事件流在发送响应体时进行。
+        """
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        subscription = self.events.subscribe(*channels, last_event_id=last_event_id)
+        return EventStreamResponse(subscription, heartbeat=heartbeat, retry=retry)
+    
+    def concurrency_limit(self, policy):
+        """添加全局并发限制，在限流之后、打开会话之前执行"""
+        self.concurrency_limits.append(policy)
+        return self
+        
+    def _concurrency_policies(self):
+        policies = [('global', policy) for policy in self.concurrency_limits]
+        for endpoint, endpoint_policies in self.route_concurrency.items():
+            policies += [(endpoint, policy) for policy in endpoint_policies]
+        return policies
+        
+    def rate_limit(self, policy):
+        """添加全局限流策略，在会话和路由处理之前执行"""
+        self.rate_limits.append(policy)
+        return self
+        
     def route(self, rule, **options):
         def decorator(f):
             endpoint = options.pop('endpoint', f.__name__)
+            schema = options.pop('schema', None)
+            request_schema = options.pop('request_schema', None)
+            max_body_size = options.pop('max_body_size', None)
+            limit = options.pop('limit', None)
+            concurrency = options.pop('concurrency', None)
+            timeout = options.pop('timeout', None)
             self.url_map.add(Rule(rule, endpoint=endpoint, **options))
             self.endpoints[endpoint] = f
             
+            # 路由级限流策略
+            if limit is not None:
+                self.route_limits[endpoint] = limit if isinstance(limit, (list, tuple)) else [limit]
+            
+            # 路由级超时（秒）
+            if timeout is not None:
+                self.route_timeouts[endpoint] = timeout
+            
+            # 路由级并发限制
+            if concurrency is not None:
+                self.route_concurrency[endpoint] = (
+                    concurrency if isinstance(concurrency, (list, tuple)) else [concurrency])
+            
+            # 路由 schema 编译为 dump 函数，处理函数返回普通数据时用它序列化
+            if schema is not None:
+                self.route_dumpers[endpoint] = compile_schema(schema)
+            
+            # 请求体 schema 每个路由只实例化一次，请求之间复用
+            if request_schema is not None:
+                self.route_validators[endpoint] = (
+                    request_schema() if isinstance(request_schema, type) else request_schema)
+                if max_body_size is not None:
+                    self.route_body_limits[endpoint] = max_body_size
+            
             # 添加 OpenAPI 文档
-            if 'schema' in options:
-                # 注册响应模式
-                self.spec.components.schema(
-                    options['schema'].__name__,
-                    schema=options['schema']
-                )
+            if schema is not None or request_schema is not None:
+                # 注册模式，多个路由共用同一模式时只注册一次
+                for component in (schema, request_schema):
+                    if (isinstance(component, type)
+                            and component.__name__ not in self.spec.components.schemas):
+                        self.spec.components.schema(
+                            component.__name__,
+                            schema=component
+                        )
+                
+                operation = {'responses': {}}
+                if schema is not None:
+                    operation['responses']['200'] = {
+                        'description': 'Successful response',
+                        'content': {
+                            'application/json': {
+                                'schema': schema
+                            }
+                        }
+                    }
+                if request_schema is not None:
+                    operation['requestBody'] = {
+                        'required': True,
+                        'content': {
+                            'application/json': {
+                                'schema': request_schema
+                            }
+                        }
+                    }
+                    operation['responses']['400'] = {'description': 'Validation error'}
+                    operation['responses']['413'] = {'description': 'Request body too large'}
                 
                 # 获取 HTTP 方法
                 methods = options.get('methods', ['GET'])
@@ -86,20 +525,7 @@ class WebFramework:
                     method = method.lower()
                     self.spec.path(
                         path=rule,
-                        operations={
-                            method: {
-                                'responses': {
-                                    '200': {
-                                        'description': 'Successful response',
-                                        'content': {
-                                            'application/json': {
-                                                'schema': options['schema']
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                        }
+                        operations={method: operation}
                     )
             
             return f
@@ -112,18 +538,146 @@ class WebFramework:
             return f
         return decorator
     
-    def dispatch_request(self, request):
+    def match_request(self, request):
+        """匹配路由，结果保存在 request 上"""
         adapter = self.url_map.bind_to_environ(request.environ)
         try:
-            endpoint, values = adapter.match()
-            return self.endpoints[endpoint](request, **values)
+            request.endpoint, request.view_args = adapter.match()
+        except HTTPException as e:
+            request.routing_exception = e
+    
+    def load_user(self, request):
+        """通过 user_loader 解析当前用户，每个请求只解析一次"""
+        if request.user is None and self.user_loader is not None:
+            request.user = self.user_loader(request)
+        return request.user
+    
+    def check_rate_limits(self, request):
+        """执行全局和路由级限流策略，超限时返回 429 响应"""
+        policies = [('global', policy) for policy in self.rate_limits]
+        policies += [(request.endpoint, policy) for policy in self.route_limits.get(request.endpoint, [])]
+        headers = None
+        for default_scope, policy in policies:
+            key = policy.key_for(self, request)
+            if key is None:
+                continue
+            result = policy.limiter.check(f'{policy.scope or default_scope}:{key}')
+            # 窗口边界处 reset 可能为 0，客户端按 0 秒重试会立即再次被拒绝，至少为 1 秒
+            reset = max(1, math.ceil(result.reset))
+            
+            # 使用剩余配额最少的策略生成 RateLimit-* 响应头
+            if headers is None or result.remaining < headers['RateLimit-Remaining'] or not result.allowed:
+                headers = {
+                    'RateLimit-Limit': result.limit,
+                    'RateLimit-Remaining': result.remaining,
+                    'RateLimit-Reset': reset
+                }
+            if not result.allowed:
+                response = self.handle_error(TooManyRequests(retry_after=reset))
+                response.headers['Retry-After'] = str(reset)
+                response.headers.update({k: str(v) for k, v in headers.items()})
+                return response, None
+        return None, headers
+    
+    def acquire_concurrency(self, request):
+        """依次占用全局和路由级并发名额，任一失败时释放已占用的名额并返回 503 响应"""
+        policies = self.concurrency_limits + self.route_concurrency.get(request.endpoint, [])
+        acquired = []
+        for policy in policies:
+            if not policy.acquire(request.remaining()):
+                for held in acquired:
+                    held.release()
+                reason = 'queue_timeout' if policy.max_queue_wait > 0 else 'limit'
+                self.requests_shed.inc(endpoint=request.endpoint or '<unmatched>', reason=reason)
+                response = self.handle_error(ServiceUnavailable(retry_after=policy.retry_after))
+                response.headers['Retry-After'] = str(policy.retry_after)
+                return response, []
+            acquired.append(policy)
+        return None, acquired
+    
+    def compute_deadline(self, request):
+        """根据路由超时（或 default_timeout）和请求头计算截止时间，请求头只能缩短超时"""
+        timeout = self.route_timeouts.get(request.endpoint, self.default_timeout)
+        header = request.headers.get(self.timeout_header) if self.timeout_header else None
+        if header:
+            try:
+                requested = float(header)
+            except ValueError:
+                requested = None
+            if requested is not None and requested > 0:
+                timeout = requested if timeout is None else min(timeout, requested)
+        if timeout is None:
+            return None
+        return request.start_time + timeout
+    
+    def dispatch_request(self, request):
+        if request.endpoint is None and request.routing_exception is None:
+            self.match_request(request)
+        try:
+            if request.routing_exception is not None:
+                raise request.routing_exception
+            if request.endpoint in self.route_validators and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+                self.load_body(request)
+            rv = self.endpoints[request.endpoint](request, **request.view_args)
+            if not isinstance(rv, Response):
+                rv = self.make_response(request, rv)
+            return rv
         except HTTPException as e:
             return self.handle_error(e)
         except Exception as e:
             return self.handle_error(e)
     
+    def read_body(self, request, limit):
+        """读取请求体，超过 limit 字节时抛出 413；按 Content-Length 提前拒绝，分块传输时最多读取 limit + 1 字节"""
+        if request.content_length is not None and request.content_length > limit:
+            raise RequestEntityTooLarge(f'请求体超过 {limit} 字节')
+        data = request.stream.read(limit + 1)
+        if len(data) > limit:
+            raise RequestEntityTooLarge(f'请求体超过 {limit} 字节')
+        request._cached_data = data
+        return data
+    
+    def load_body(self, request):
+        """解析并校验 request_schema 路由的请求体（JSON、MessagePack 或 CBOR），结果保存在 request.validated"""
+        schema = self.route_validators[request.endpoint]
+        self.read_body(request, self.route_body_limits.get(request.endpoint, self.max_body_size))
+        try:
+            request.validated = schema.load(request.get_payload())
+        except ValidationError as e:
+            raise RequestValidationError(e.messages) from None
+        return request.validated
+    
+    def negotiate(self, request):
+        """根据 Accept 请求头选择响应格式，默认 JSON"""
+        if len(FORMATS) == 1:
+            return JSON_MIMETYPE
+        return request.accept_mimetypes.best_match(FORMATS, default=JSON_MIMETYPE)
+    
+    def make_response(self, request, rv):
+        """把处理函数返回的数据或 (数据, 状态码[, 响应头]) 元组转换为响应，成功响应按路由 schema 序列化
+
+        响应格式按 Accept 协商，客户端接受 MessagePack 或 CBOR 且已安装对应的库时使用二进制格式。
+        """
+        status, headers = 200, None
+        if isinstance(rv, tuple):
+            rv, status, *rest = rv
+            headers = rest[0] if rest else None
+        dumper = self.route_dumpers.get(request.endpoint)
+        if dumper is not None and status < 400:
+            rv = dumper(rv)
+        mimetype = self.negotiate(request)
+        if mimetype == JSON_MIMETYPE:
+            response = JSONResponse(rv, status, headers)
+        else:
+            response = Response(FORMATS[mimetype][0](rv), status, headers, mimetype=mimetype)
+        if len(FORMATS) > 1:
+            response.vary.add('Accept')
+        return response
+    
     def handle_error(self, error):
         """处理错误"""
+        if isinstance(error, DeadlineExceeded):
+            error = GatewayTimeout(str(error))
         if isinstance(error, HTTPException):
             code = error.code
         else:
@@ -132,18 +686,35 @@ class WebFramework:
         handler = self.error_handlers.get(code)
         if handler:
             return handler(error)
+        
+        # 校验错误带有逐字段的错误信息，不使用缓存的响应体
+        if isinstance(error, RequestValidationError):
+            return JSONResponse({'error': error.description, 'code': code, 'errors': error.errors}, code)
             
-        return Response(
-            json.dumps({
-                'error': str(error),
-                'code': code
-            }, ensure_ascii=False),
-            status=code,
-            mimetype='application/json'
-        )
+        return JSONResponse(_error_body(str(error), code), code)
+    
+    def close_db(self, request, response):
+        """结束请求级数据库会话：成功响应提交，否则回滚，最后关闭连接"""
+        db = request._db
+        if db is None:
+            return response
+        try:
+            if response.status_code < 400:
+                db.commit()
+            else:
+                db.rollback()
+        except Exception as e:
+            db.rollback()
+            response = self.handle_error(e)
+        finally:
+            request.db_checkout_time = db.info.get('pool_checkout_time', 0.0)
+            db.close()
+            request._db = None
+        return response
     
     def wsgi_app(self, environ, start_response):
         request = Request(environ)
+        request.db_session_factory = self.db_session_factory
         
         # 处理 OpenAPI 文档请求
         if request.path == '/openapi.json':
@@ -166,28 +737,164 @@ class WebFramework:
                 except FileNotFoundError:
                     return Response('Swagger UI not found', status=404)(environ, start_response)
         
+        # 处理 Prometheus 指标请求
+        if self.metrics_path and request.path == self.metrics_path:
+            return Response(
+                self.metrics.render(),
+                mimetype='text/plain; version=0.0.4'
+            )(environ, start_response)
+        
+        request.start_time = time.monotonic()
+        start_time = time.perf_counter()
+        root, token = self.tracer.start_request(request)
+        self.requests_in_flight.inc()
+        try:
+            response = self.full_dispatch_request(request)
+        except BaseException:
+            root.finish()
+            raise
+        finally:
+            self.requests_in_flight.dec()
+            self.tracer.detach(token)
+        duration = time.perf_counter() - start_time
+        self.record_metrics(request, response, duration)
+        if self.access_log is not None:
+            self.access_log.log_request(request, response, duration)
+        response.headers.setdefault('X-Request-ID', request.request_id)
+        
+        # 响应体写完后的回调：结束根 span，提交登记的后台任务，关闭上传的临时文件
+        callbacks = []
+        if root is not NULL_SPAN:
+            root.set_attribute('endpoint', request.endpoint)
+            root.set_attribute('status', response.status_code)
+            callbacks += [root.child('response.write').finish, root.finish]
+        if request._deferred:
+            callbacks.append(functools.partial(self.run_deferred, request))
+        if request._uploads:
+            callbacks.append(request.close)
+        app_iter = response(environ, start_response)
+        if not callbacks:
+            return app_iter
+        return ClosingIterator(app_iter, callbacks)
+    
+    def full_dispatch_request(self, request):
+        """执行完整的请求处理流程，返回最终响应"""
+        tracer = self.tracer
+        
+        # 路由匹配和限流在会话与数据库之前进行，被拒绝的请求不会产生存储开销
+        with tracer.span('match'):
+            self.match_request(request)
+        
+        # 截止时间通过上下文变量传递给数据库层
+        request.deadline = self.compute_deadline(request)
+        if request.deadline is None:
+            return self.dispatch_matched_request(request)
+        token = set_deadline(request.deadline)
+        try:
+            return self.dispatch_matched_request(request)
+        finally:
+            reset_deadline(token)
+    
+    def dispatch_matched_request(self, request):
+        """执行请求前回调、限流和并发限制，然后处理请求"""
+        tracer = self.tracer
+        with tracer.span('before_request'):
+            for func in self.before_request_funcs:
+                func(request)
+        with tracer.span('rate_limit'):
+            # 限流后端或 user_loader 出错时转换为错误响应，仍记录指标和访问日志
+            try:
+                rejected, rate_limit_headers = self.check_rate_limits(request)
+            except Exception as e:
+                rejected, rate_limit_headers = self.handle_error(e), None
+        if rejected is not None:
+            return self.finalize_request(request, rejected)
+        
+        # 并发超限时立即返回 503，不打开会话和数据库
+        with tracer.span('concurrency'):
+            shed, acquired = self.acquire_concurrency(request)
+        if shed is not None:
+            return self.finalize_request(request, shed)
+        if not acquired:
+            return self.process_request(request, rate_limit_headers)
+        
+        start_time = time.perf_counter()
+        try:
+            return self.process_request(request, rate_limit_headers)
+        finally:
+            latency = time.perf_counter() - start_time
+            for policy in acquired:
+                policy.release(latency)
+    
+    def process_request(self, request, rate_limit_headers=None):
+        """打开会话，执行中间件和处理函数，提交数据库并保存会话"""
+        tracer = self.tracer
+        
+        # 排队等待已耗尽时间预算的请求直接返回 504
+        if request.deadline is not None and time.monotonic() >= request.deadline:
+            return self.finalize_request(request, self.handle_error(DeadlineExceeded('请求处理前已超过截止时间')))
+        
         # 初始化会话
         if self.session_interface:
-            session = self.session_interface.open_session(self, request)
-            if session is None:
-                session = self.session_interface.make_null_session(self)
+            session_start = time.perf_counter()
+            with tracer.span('session.open'):
+                session = self.session_interface.open_session(self, request)
+                if session is None:
+                    session = self.session_interface.make_null_session(self)
             request.session = session
+            self.session_duration.observe(time.perf_counter() - session_start, operation='open')
         
         # 执行所有中间件
-        response = request
-        for middleware in self.middlewares:
-            response = middleware(request)
-            if isinstance(response, Response):
-                break
-                
-        if not isinstance(response, Response):
-            response = self.dispatch_request(request)
+        try:
+            response = request
+            with tracer.span('middleware'):
+                for middleware in self.middlewares:
+                    response = middleware(request)
+                    if isinstance(response, Response):
+                        break
+                    
+            if not isinstance(response, Response):
+                with tracer.span('handler', endpoint=request.endpoint):
+                    response = self.dispatch_request(request)
+        except Exception as e:
+            response = self.handle_error(e)
+            
+        # 结束请求级数据库会话
+        with tracer.span('db.close'):
+            response = self.close_db(request, response)
             
         # 保存会话
         if self.session_interface and hasattr(request, 'session'):
-            self.session_interface.save_session(self, request.session, response)
+            session_start = time.perf_counter()
+            with tracer.span('session.save'):
+                self.session_interface.save_session(self, request.session, response)
+            self.session_duration.observe(time.perf_counter() - session_start, operation='save')
             
-        return response(environ, start_response)
+        if rate_limit_headers:
+            for name, value in rate_limit_headers.items():
+                response.headers.setdefault(name, str(value))
+            
+        with tracer.span('after_request'):
+            return self.finalize_request(request, response)
+    
+    def record_metrics(self, request, response, duration):
+        """记录请求指标，未匹配的路径统一记为 <unmatched>，避免标签数量失控"""
+        endpoint = request.endpoint or '<unmatched>'
+        self.requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        self.request_duration.observe(duration, endpoint=endpoint, method=request.method)
+        if response.status_code == 504:
+            self.request_timeouts.inc(endpoint=endpoint)
+        if request.db_checkout_time:
+            self.db_checkout_duration.observe(request.db_checkout_time, endpoint=endpoint)
+        sql_stats = getattr(request, 'sql_stats', None)
+        if sql_stats is not None:
+            self.db_query_duration.observe(sql_stats.total_time, endpoint=endpoint)
+    
+    def finalize_request(self, request, response):
+        """执行 after_request 回调"""
+        for func in self.after_request_funcs:
+            response = func(request, response)
+        return response
     
     def __call__(self, environ, start_response):
         return self.wsgi_app(environ, start_response)
@@ -215,9 +922,12 @@ class WebFramework:
         print("\n=== 其他端点 ===")
         print("- /openapi.json: OpenAPI规范")
         print("- /docs: API文档界面")
+        if self.metrics_path:
+            print(f"- {self.metrics_path}: Prometheus 指标")
         print("-" * 50)
     
     def run(self, host='127.0.0.1', port=5000, debug=False):
+        self.debug = debug
         self.print_routes()
         print("\nWFrame 应用已启动！")
         print(f"访问 http://{host}:{port} 查看应用")
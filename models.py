@@ -1,15 +1,398 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
+from sqlalchemy import (
+    create_engine, event, select, lambda_stmt, or_,
+    Column, Integer, String, DateTime, Boolean
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker, object_session
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
 from datetime import datetime
+import contextvars
+import itertools
+import logging
 import os
+import queue
+import threading
+import time
 
-# 创建数据库引擎
+try:
+    from .deadlines import DeadlineExceeded, remaining_time, check_deadline
+except ImportError:
+    from deadlines import DeadlineExceeded, remaining_time, check_deadline
+
+# 数据库连接配置
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///app.db')
-engine = create_engine(DATABASE_URL)
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+# SQLite 连接建立时执行的 PRAGMA，可通过 create_db_engine(sqlite_pragmas=...) 覆盖
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',        # 读写互不阻塞
+    'synchronous': 'NORMAL',      # WAL 模式下可保证一致性，减少 fsync
+    'cache_size': -64000,         # 页缓存 64MB（负数单位为 KB）
+    'mmap_size': 268435456,       # 256MB 内存映射读
+    'busy_timeout': 5000,         # 锁等待 5 秒后才报 database is locked
+    'temp_store': 'MEMORY',
+}
+
+# 记录当前线程最近一次从连接池取连接的等待时间
+_checkout = threading.local()
+
+class TimedQueuePool(QueuePool):
+    """记录连接检出等待时间的连接池，等待时间不超过当前请求的剩余时间"""
+    @property
+    def _timeout(self):
+        remaining = remaining_time()
+        if remaining is None:
+            return self._pool_timeout
+        if remaining <= 0:
+            raise DeadlineExceeded('等待数据库连接时请求已超过截止时间')
+        return min(self._pool_timeout, remaining)
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self._pool_timeout = value
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            check_deadline()
+            raise
+        finally:
+            _checkout.wait = time.perf_counter() - start
+
+# 截止时间传递到语句执行：执行前检查剩余时间，执行中由数据库中断超时的语句
+# （SQLite 使用进度回调，PostgreSQL 使用 SET LOCAL statement_timeout）
+
+def _progress_handler(cursor):
+    """sqlite3 连接的 set_progress_handler，异步驱动等不支持时返回 None"""
+    return getattr(getattr(cursor, 'connection', None), 'set_progress_handler', None)
+
+# 事务控制语句不受截止时间限制，保证超时后仍能回滚到保存点
+_TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+# PostgreSQL 的 statement_timeout 在每个事务中只设置一次，此后语句最多可能比截止时间多运行
+# 自设置以来经过的时间；超出剩余时间的这个比例时才重新设置
+STATEMENT_TIMEOUT_SLACK = 0.1
+
+def _apply_statement_timeout(conn, cursor, remaining):
+    """按剩余时间设置 PostgreSQL statement_timeout，同一事务内剩余时间变化不大时不重复设置"""
+    # 保存点回滚会撤销其中的 SET LOCAL，因此按最内层的事务或保存点记录
+    transaction = conn.get_nested_transaction() or conn.get_transaction()
+    applied = conn.info.get('wframe_statement_timeout')
+    if transaction is not None and applied is not None and applied[0] is transaction:
+        timeout = applied[1]
+        if remaining <= timeout <= remaining * (1 + STATEMENT_TIMEOUT_SLACK):
+            return
+    timeout_ms = max(1, int(remaining * 1000))
+    cursor.execute(f'SET LOCAL statement_timeout = {timeout_ms}')
+    conn.info['wframe_statement_timeout'] = (transaction, timeout_ms / 1000)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _apply_deadline(conn, cursor, statement, parameters, context, executemany):
+    remaining = remaining_time()
+    if remaining is None or statement.lstrip()[:9].upper().startswith(_TRANSACTION_CONTROL):
+        return
+    if remaining <= 0:
+        raise DeadlineExceeded('执行 SQL 前请求已超过截止时间')
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        set_handler = _progress_handler(cursor)
+        if set_handler is not None:
+            deadline = time.monotonic() + remaining
+            set_handler(lambda: time.monotonic() >= deadline, 1000)
+    elif dialect == 'postgresql':
+        _apply_statement_timeout(conn, cursor, remaining)
+
+def _clear_deadline(conn, cursor):
+    if conn.dialect.name == 'sqlite':
+        set_handler = _progress_handler(cursor)
+        if set_handler is not None:
+            set_handler(None, 0)
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _clear_deadline_after_execute(conn, cursor, statement, parameters, context, executemany):
+    if remaining_time() is not None:
+        _clear_deadline(conn, cursor)
+
+@event.listens_for(Engine, 'handle_error')
+def _deadline_error(context):
+    # 建立连接失败时没有连接和游标，保留原始异常
+    if remaining_time() is None or context.connection is None:
+        return
+    if context.cursor is not None:
+        _clear_deadline(context.connection, context.cursor)
+    # 被数据库中断的语句统一转换为 DeadlineExceeded
+    if remaining_time() <= 0 and not isinstance(context.original_exception, DeadlineExceeded):
+        raise DeadlineExceeded('SQL 执行超过请求截止时间') from context.original_exception
+
+def is_sqlite_memory(url):
+    """判断是否为 SQLite 内存数据库"""
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
+def create_db_engine(url=None, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                     pool_timeout=POOL_TIMEOUT, sqlite_pragmas=None, **options):
+    """创建数据库引擎，连接池参数可由应用配置
+
+    SQLite 数据库会在每个连接建立时应用 SQLITE_PRAGMAS，并自行管理事务开始语句，
+    以便 SAVEPOINT 正常工作、写事务可以使用 BEGIN IMMEDIATE。
+    """
+    url = url or DATABASE_URL
+    if not url.startswith('sqlite'):
+        return create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            **options
+        )
+
+    options.setdefault('connect_args', {})['check_same_thread'] = False
+    pragmas = dict(SQLITE_PRAGMAS if sqlite_pragmas is None else sqlite_pragmas)
+    if is_sqlite_memory(url):
+        # 内存数据库只能共享同一个连接，WAL 不适用
+        pragmas.pop('journal_mode', None)
+        engine = create_engine(url, poolclass=StaticPool, **options)
+    else:
+        engine = create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            **options
+        )
+
+    _install_sqlite_events(engine, pragmas)
+    return engine
+
+def _install_sqlite_events(engine, pragmas):
+    """为 SQLite 引擎注册 PRAGMA 设置和事务开始语句"""
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        # 关闭驱动的隐式事务，由下面的 begin 事件发出 BEGIN
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _begin(conn):
+        mode = conn.get_execution_options().get('sqlite_begin', 'DEFERRED')
+        conn.exec_driver_sql(f'BEGIN {mode}')
+
+# 创建数据库引擎
+engine = create_db_engine()
+
+# 只读副本引擎，由 configure_database(replica_urls=...) 配置
+replica_engines = []
+replica_strategy = 'round_robin'
+
+# run_write 提交后这段时间内，同一上下文（请求）中的会话读取也走主库，覆盖副本复制延迟
+primary_sticky_seconds = 5.0
+_primary_until = contextvars.ContextVar('wframe_primary_until', default=0.0)
+_replica_counter = itertools.count()
+
+def choose_replica():
+    """选择一个副本：round_robin 轮询，least_loaded 选检出连接最少的"""
+    if replica_strategy == 'least_loaded':
+        return min(replica_engines, key=lambda e: e.pool.checkedout() if hasattr(e.pool, 'checkedout') else 0)
+    return replica_engines[next(_replica_counter) % len(replica_engines)]
+
+class RoutingSession(Session):
+    """读写分离会话
+
+    SELECT 发往只读副本，flush 和其他写语句发往主库。会话中一旦发生写操作，
+    之后的读取也固定走主库（读己之写），请求级会话因此在请求剩余部分保持粘滞；
+    当前上下文中 run_write 在其他会话里提交的写操作同样会使读取走主库。
+    未配置副本时与普通 Session 相同。
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not replica_engines or self.info.get('primary_sticky'):
+            return super().get_bind(mapper, clause=clause, **kw)
+        if _primary_until.get() > time.monotonic():
+            self.info['primary_sticky'] = True
+            return super().get_bind(mapper, clause=clause, **kw)
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.info['primary_sticky'] = True
+            return super().get_bind(mapper, clause=clause, **kw)
+        if getattr(clause, 'is_select', False):
+            return choose_replica()
+        return super().get_bind(mapper, clause=clause, **kw)
 
 # 创建会话工厂
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+@event.listens_for(SessionLocal, 'after_begin')
+def _record_checkout_wait(session, transaction, connection):
+    """把连接检出等待时间累计到 session.info['pool_checkout_time']"""
+    wait = getattr(_checkout, 'wait', None)
+    if wait is not None:
+        _checkout.wait = None
+        session.info['pool_checkout_time'] = session.info.get('pool_checkout_time', 0.0) + wait
+
+def configure_database(url=None, replica_urls=None, strategy='round_robin', write_queue=False, **pool_options):
+    """按应用配置重建全局引擎，已有的 SessionLocal 会绑定到新引擎
+
+    replica_urls 为只读副本地址列表，SessionLocal 创建的会话会把读取分发到副本；
+    strategy 为副本选择策略，'round_robin' 或 'least_loaded'；
+    write_queue 为 True 时 run_write 在 SQLite 上经写队列批量提交（见 WriteQueue）。
+    """
+    global engine, replica_strategy, use_write_queue, _write_queue
+    if strategy not in ('round_robin', 'least_loaded'):
+        raise ValueError(f'未知的副本选择策略: {strategy}')
+    if _write_queue is not None:
+        _write_queue.close()
+        _write_queue = None
+    engine.dispose()
+    for replica in replica_engines:
+        replica.dispose()
+
+    engine = create_db_engine(url, **pool_options)
+    replica_engines[:] = [create_db_engine(replica_url, **pool_options) for replica_url in replica_urls or ()]
+    replica_strategy = strategy
+    use_write_queue = write_queue
+    SessionLocal.configure(bind=engine)
+    return SessionLocal
+
+class WriteQueue:
+    """单写线程队列
+
+    SQLite 同一时刻只允许一个写事务，多线程各自提交会互相等待锁。
+    写操作提交到队列后由唯一的写线程按批执行：一批操作共用一个 BEGIN IMMEDIATE 事务，
+    每个操作包在 SAVEPOINT 中，失败时只回滚它自己，其余操作照常提交。
+    默认的 WAL + synchronous=NORMAL 下单次提交已经很便宜，写队列反而更慢
+    （见 benchmarks/sqlite_write_bench.py），只在 synchronous=FULL 等提交代价高的配置下考虑启用。
+    """
+    def __init__(self, bind, max_batch=64, max_wait=0.002):
+        self.session_factory = sessionmaker(bind=bind, autoflush=False, expire_on_commit=False)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='wframe-db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """提交写操作 fn(session, *args, **kwargs)，返回 Future"""
+        future = Future()
+        # 在提交方的上下文中执行，请求级的 SQL 统计等上下文变量对写操作同样生效
+        context = contextvars.copy_context()
+        self._queue.put((future, context, fn, args, kwargs))
+        return future
+
+    def execute(self, fn, *args, **kwargs):
+        """提交写操作并等待其提交完成，返回 fn 的返回值"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._execute_batch(batch)
+
+    @staticmethod
+    def _run_operation(session, fn, args, kwargs):
+        # 提交方的请求已超时时不再执行
+        check_deadline()
+        with session.begin_nested():
+            return fn(session, *args, **kwargs)
+
+    def _execute_batch(self, batch):
+        session = self.session_factory()
+        done = []
+        try:
+            session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+            for future, context, fn, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = context.run(self._run_operation, session, fn, args, kwargs)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    done.append((future, result))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            done = []
+        finally:
+            session.close()
+        self.batches += 1
+        self.operations += len(batch)
+        for future, result in done:
+            future.set_result(result)
+
+    def close(self):
+        """处理完已提交的操作后停止写线程"""
+        self._queue.put(None)
+        self._thread.join()
+
+# 是否经写队列执行 run_write，由 configure_database(write_queue=True) 开启
+use_write_queue = False
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """获取绑定到当前引擎的全局写队列"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue(engine)
+        return _write_queue
+
+def run_write(fn, *args, **kwargs):
+    """在独立会话中执行并提交写操作 fn(session, ...)
+
+    开启写队列时 SQLite 文件数据库经写队列批量提交；内存数据库只有一个共享连接（StaticPool），
+    写线程无法在其上另开事务，始终直接提交。
+    提交后 primary_sticky_seconds 秒内当前上下文的读取走主库，请求会话能读到刚写入的数据。
+    """
+    try:
+        if use_write_queue and engine.dialect.name == 'sqlite' and not isinstance(engine.pool, StaticPool):
+            return get_write_queue().execute(fn, *args, **kwargs)
+        db = SessionLocal()
+        try:
+            result = fn(db, *args, **kwargs)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    finally:
+        _primary_until.set(time.monotonic() + primary_sticky_seconds)
 
 # 创建基类
 Base = declarative_base()
@@ -39,4 +422,433 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# 常用 User 查询：lambda_stmt 按代码位置缓存语句构造和编译结果，
+# 每次调用只提取绑定参数，省去 ORM Query 的构造和缓存键计算
+
+def _user_by_username(username):
+    return lambda_stmt(lambda: select(User).where(User.username == username).limit(1))
+
+def _user_by_email(email):
+    return lambda_stmt(lambda: select(User).where(User.email == email).limit(1))
+
+def _user_by_id(user_id):
+    return lambda_stmt(lambda: select(User).where(User.id == user_id))
+
+def _user_id_by_username(username):
+    return lambda_stmt(lambda: select(User.id).where(User.username == username).limit(1))
+
+def _user_conflicts(username, email):
+    if email:
+        return lambda_stmt(lambda: select(User.username, User.email).where(
+            or_(User.username == username, User.email == email)
+        ).limit(2))
+    return lambda_stmt(lambda: select(User.username, User.email).where(
+        User.username == username
+    ).limit(1))
+
+def _conflict_fields(rows, username, email):
+    conflicts = set()
+    for row in rows:
+        if row.username == username:
+            conflicts.add('username')
+        if email and row.email == email:
+            conflicts.add('email')
+    return conflicts
+
+def find_user_by_username(db, username):
+    """按用户名查询用户"""
+    return db.execute(_user_by_username(username)).scalars().first()
+
+def find_user_by_email(db, email):
+    """按邮箱查询用户"""
+    return db.execute(_user_by_email(email)).scalars().first()
+
+def find_user_by_id(db, user_id):
+    """按 id 查询用户"""
+    return db.execute(_user_by_id(user_id)).scalars().first()
+
+def user_exists(db, username):
+    """检查用户名是否已存在"""
+    return db.execute(_user_id_by_username(username)).first() is not None
+
+def find_user_conflicts(db, username, email=None):
+    """一次查询检查用户名和邮箱是否已被使用，返回冲突字段的集合"""
+    return _conflict_fields(db.execute(_user_conflicts(username, email)), username, email)
+
+# 用户缓存中的只读快照，脱离会话，可在线程间共享
+UserSnapshot = namedtuple(
+    'UserSnapshot',
+    'id username password email is_active created_at updated_at'
+)
+
+_MISSING = object()
+
+class UserCache:
+    """User 行的读穿透缓存
+
+    按用户名和 id 两个键缓存只读快照，条目有 TTL 和数量上限（LRU 淘汰），
+    查询结果为空不缓存（其他进程刚注册的用户不会被误判为不存在）。
+    User 的插入、更新、删除在 flush 时立即失效，并在事务提交后再失效一次。每次失效递增 generation，
+    事务开始后发生过失效的会话读到的可能是旧快照，其查询结果不写入缓存。
+
+    缓存按进程独立，失效只发生在执行写操作的进程内：其他 worker 或 cli 导入的修改要等 TTL 过期才可见。
+    因此只用于展示类数据，校验密码、检查账户状态等鉴权逻辑应直接查询数据库（find_user_by_username）。
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._by_username = OrderedDict()
+        self._by_id = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, table, key):
+        with self._lock:
+            entry = table.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                table.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return _MISSING
+
+    def _put(self, table, key, snapshot):
+        table[key] = (time.monotonic() + self.ttl, snapshot)
+        table.move_to_end(key)
+        while len(table) > self.maxsize:
+            table.popitem(last=False)
+
+    def _store(self, db, snapshot):
+        if snapshot is None:
+            return
+        with self._lock:
+            if db.info.get('user_cache_generation') != self.generation:
+                return
+            self._put(self._by_username, snapshot.username, snapshot)
+            self._put(self._by_id, snapshot.id, snapshot)
+
+    def get_by_username(self, db, username):
+        """按用户名获取用户快照，不存在时返回 None"""
+        snapshot = self._get(self._by_username, username)
+        if snapshot is _MISSING:
+            snapshot = snapshot_user(find_user_by_username(db, username))
+            self._store(db, snapshot)
+        return snapshot
+
+    async def async_get_by_username(self, db, username):
+        """按用户名获取用户快照，db 为 AsyncSession"""
+        snapshot = self._get(self._by_username, username)
+        if snapshot is _MISSING:
+            snapshot = snapshot_user(await async_find_user_by_username(db, username))
+            self._store(db.sync_session, snapshot)
+        return snapshot
+
+    def get_by_id(self, db, user_id):
+        """按 id 获取用户快照，不存在时返回 None"""
+        snapshot = self._get(self._by_id, user_id)
+        if snapshot is _MISSING:
+            snapshot = snapshot_user(find_user_by_id(db, user_id))
+            self._store(db, snapshot)
+        return snapshot
+
+    def invalidate(self, username=None, user_id=None):
+        """失效指定用户，同时清除该用户旧用户名下的条目"""
+        with self._lock:
+            self.generation += 1
+            entry = self._by_id.pop(user_id, None) if user_id is not None else None
+            if entry is not None and entry[1] is not None:
+                self._by_username.pop(entry[1].username, None)
+            if username is not None:
+                entry = self._by_username.pop(username, None)
+                if entry is not None and entry[1] is not None:
+                    self._by_id.pop(entry[1].id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._by_username.clear()
+            self._by_id.clear()
+
+    def stats(self):
+        """命中率统计"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._by_id),
+        }
+
+def snapshot_user(user):
+    """把 User 对象转换为只读快照"""
+    if user is None:
+        return None
+    return UserSnapshot(user.id, user.username, user.password, user.email,
+                        user.is_active, user.created_at, user.updated_at)
+
+user_cache = UserCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60))
+)
+
+def get_user_by_username(db, username):
+    """经缓存按用户名查询用户"""
+    return user_cache.get_by_username(db, username)
+
+def get_user_by_id(db, user_id):
+    """经缓存按 id 查询用户"""
+    return user_cache.get_by_id(db, user_id)
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user_cache(mapper, connection, target):
+    user_cache.invalidate(username=target.username, user_id=target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('user_cache_invalidate', set()).add((target.username, target.id))
+
+@event.listens_for(Session, 'after_begin')
+def _remember_user_cache_generation(session, transaction, connection):
+    session.info['user_cache_generation'] = user_cache.generation
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_user_cache_after_commit(session):
+    for username, user_id in session.info.pop('user_cache_invalidate', ()):
+        user_cache.invalidate(username=username, user_id=user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_cache_invalidations(session):
+    session.info.pop('user_cache_invalidate', None)
+
+# SQL 执行统计：按请求记录查询次数、耗时和最慢语句，并检测 N+1 查询
+
+logger = logging.getLogger('wframe.sql')
+
+class QueryStats:
+    """单个请求的 SQL 统计"""
+    def __init__(self, slowest_count=5):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_count = slowest_count
+        self.slowest = []      # [(耗时, 语句)]，按耗时降序
+        self.statements = {}   # 语句 -> 执行次数
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        if len(self.slowest) < self.slowest_count or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[self.slowest_count:]
+
+    def repeated(self, threshold):
+        """同一请求内重复执行达到阈值的语句，通常意味着 N+1 查询"""
+        return [(statement, count) for statement, count in self.statements.items() if count >= threshold]
+
+_current_stats = contextvars.ContextVar('wframe_query_stats', default=None)
+
+class SQLInstrumentation:
+    """可选的 SQL 执行统计
+
+    通过 Engine 类级别的游标事件采集所有引擎（包括之后重新配置的引擎和副本）的语句，
+    统计结果挂在 request.sql_stats 上；调试模式下以 Server-Timing 响应头输出；
+    同一请求内同一语句执行次数达到 n_plus_one_threshold 时记录为疑似 N+1 查询；
+    route_stats() 返回按路由汇总的数据，供指标接口使用。
+    """
+    def __init__(self, slowest_count=5, n_plus_one_threshold=5):
+        self.slowest_count = slowest_count
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.app = None
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """注册 SQLAlchemy 游标事件"""
+        if not self._installed:
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            event.listen(Engine, 'handle_error', self._execute_error)
+            self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            event.remove(Engine, 'before_cursor_execute', self._before_execute)
+            event.remove(Engine, 'after_cursor_execute', self._after_execute)
+            event.remove(Engine, 'handle_error', self._execute_error)
+            self._installed = False
+
+    def init_app(self, app):
+        """接入 WebFramework 的请求生命周期"""
+        self.app = app
+        self.install()
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        return self
+
+    # 开始时间保存在本次执行的 context 上，语句失败时随 context 一起丢弃，不会残留在连接上
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _current_stats.get() is not None:
+            context._wframe_query_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record(context, statement)
+
+    def _execute_error(self, exception_context):
+        """失败的语句同样计入统计"""
+        self._record(exception_context.execution_context, exception_context.statement)
+
+    def _record(self, context, statement):
+        stats = _current_stats.get()
+        start = getattr(context, '_wframe_query_start', None)
+        if start is not None:
+            context._wframe_query_start = None
+            if stats is not None:
+                stats.record(statement, time.perf_counter() - start)
+
+    def start_request(self, request):
+        request.sql_stats = QueryStats(self.slowest_count)
+        request.sql_stats_token = _current_stats.set(request.sql_stats)
+
+    def finish_request(self, request, response):
+        stats = getattr(request, 'sql_stats', None)
+        if stats is None:
+            return response
+        _current_stats.reset(request.sql_stats_token)
+
+        n_plus_one = stats.repeated(self.n_plus_one_threshold)
+        for statement, count in n_plus_one:
+            logger.warning('疑似 N+1 查询: %s %s 中执行了 %d 次: %s',
+                           request.method, request.path, count, statement)
+        self._aggregate(request.endpoint or '<unmatched>', stats, n_plus_one)
+
+        if self.app is not None and self.app.debug:
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={stats.total_time * 1000:.2f};desc="{stats.count} queries"'
+            )
+        return response
+
+    def _aggregate(self, endpoint, stats, n_plus_one):
+        with self._lock:
+            route = self._routes.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'db_time': 0.0, 'max_queries': 0, 'n_plus_one': 0,
+            })
+            route['requests'] += 1
+            route['queries'] += stats.count
+            route['db_time'] += stats.total_time
+            route['max_queries'] = max(route['max_queries'], stats.count)
+            route['n_plus_one'] += len(n_plus_one)
+
+    def route_stats(self):
+        """按路由汇总的 SQL 统计快照"""
+        with self._lock:
+            return {endpoint: dict(route) for endpoint, route in self._routes.items()}
+
+# 异步数据访问：与同步层共用 Base 元数据和查询语句，需要安装 greenlet 和对应的异步驱动
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+def to_async_url(url):
+    """把同步数据库地址转换为异步驱动地址"""
+    scheme, sep, rest = url.partition('://')
+    if scheme in ASYNC_DRIVERS.values():
+        return url
+    driver = ASYNC_DRIVERS.get(scheme.split('+', 1)[0])
+    if driver is None:
+        raise ValueError(f'不支持的异步数据库: {scheme}')
+    return driver + sep + rest
+
+def create_async_db_engine(url=None, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                           pool_timeout=POOL_TIMEOUT, sqlite_pragmas=None, **options):
+    """创建异步数据库引擎，SQLite 使用与同步引擎相同的 PRAGMA"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    url = to_async_url(url or DATABASE_URL)
+    if url.startswith('sqlite') and is_sqlite_memory(url.replace('+aiosqlite', '')):
+        pragmas = dict(SQLITE_PRAGMAS if sqlite_pragmas is None else sqlite_pragmas)
+        pragmas.pop('journal_mode', None)
+        async_engine = create_async_engine(url, poolclass=StaticPool, **options)
+    else:
+        async_engine = create_async_engine(
+            url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            **options
+        )
+        pragmas = SQLITE_PRAGMAS if sqlite_pragmas is None else sqlite_pragmas
+    if url.startswith('sqlite'):
+        _install_sqlite_events(async_engine.sync_engine, pragmas)
+    return async_engine
+
+async_engine = None
+AsyncSessionLocal = None
+_async_lock = threading.Lock()
+
+def configure_async_database(url=None, **pool_options):
+    """配置异步引擎和会话工厂，默认使用 DATABASE_URL 对应的异步驱动"""
+    global async_engine, AsyncSessionLocal
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    with _async_lock:
+        async_engine = create_async_db_engine(url, **pool_options)
+        AsyncSessionLocal = sessionmaker(
+            async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+    return AsyncSessionLocal
+
+def get_async_session_factory():
+    """获取异步会话工厂，首次使用时按默认配置创建"""
+    if AsyncSessionLocal is None:
+        configure_async_database()
+    return AsyncSessionLocal
+
+async def async_init_db():
+    """异步创建数据库表"""
+    get_async_session_factory()
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with get_async_session_factory()() as db:
+        yield db
+
+async def async_find_user_by_username(db, username):
+    """按用户名查询用户（异步）"""
+    return (await db.execute(_user_by_username(username))).scalars().first()
+
+async def async_find_user_by_email(db, email):
+    """按邮箱查询用户（异步）"""
+    return (await db.execute(_user_by_email(email))).scalars().first()
+
+async def async_find_user_by_id(db, user_id):
+    """按 id 查询用户（异步）"""
+    return (await db.execute(_user_by_id(user_id))).scalars().first()
+
+async def async_user_exists(db, username):
+    """检查用户名是否已存在（异步）"""
+    return (await db.execute(_user_id_by_username(username))).first() is not None
+
+async def async_find_user_conflicts(db, username, email=None):
+    """一次查询检查用户名和邮箱是否已被使用（异步）"""
+    rows = await db.execute(_user_conflicts(username, email))
+    return _conflict_fields(rows, username, email)
+
+async def async_get_user_by_username(db, username):
+    """经缓存按用户名查询用户（异步）"""
+    return await user_cache.async_get_by_username(db, username)
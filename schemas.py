@@ -3,6 +3,7 @@ from marshmallow import Schema, fields, validate
 class UserSchema(Schema):
     username = fields.Str(required=True, validate=validate.Length(min=3, max=50))
     password = fields.Str(required=True, validate=validate.Length(min=6, max=100))
+    email = fields.Email(load_default=None)
 
 class LoginRequestSchema(Schema):
     username = fields.Str(required=True)
@@ -21,6 +22,8 @@ class LogoutResponseSchema(Schema):
 
 class ProfileResponseSchema(Schema):
     username = fields.Str()
+    email = fields.Str()
+    created_at = fields.DateTime()
     message = fields.Str()
 
 class CreateUserResponseSchema(Schema):
@@ -2,17 +2,36 @@ import bcrypt
 import jwt
 import os
 import time
+import mmap
+import struct
+import hashlib
+import hmac
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import namedtuple
 from datetime import datetime, timedelta
 from functools import wraps
 from werkzeug.wrappers import Response
 import json
 
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl
+    fcntl = None
+
 # 从环境变量加载密钥
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', os.urandom(24).hex())
 JWT_ALGORITHM = 'HS256'
 JWT_ACCESS_TOKEN_EXPIRE_MINUTES = 30
 JWT_REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# CSRF 令牌签名密钥，多 worker 部署时需通过环境变量保持一致
+CSRF_SECRET_KEY = os.getenv('SECRET_KEY', JWT_SECRET_KEY)
+CSRF_TOKEN_MAX_AGE = 3600
+CSRF_NONCE_COOKIE = 'csrf_nonce'
+
 def hash_password(password: str) -> str:
     """使用 bcrypt 加密密码"""
     salt = bcrypt.gensalt()
@@ -46,7 +65,7 @@ def verify_token(token: str) -> dict:
         return payload
     except jwt.ExpiredSignatureError:
         raise ValueError("令牌已过期")
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         raise ValueError("无效的令牌")
 
 def token_required(f):
@@ -77,13 +96,47 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
-def generate_csrf_token() -> str:
-    """生成 CSRF 令牌"""
-    return os.urandom(32).hex()
+def load_user(request):
+    """从 Authorization 头解析用户，缺少或无效的令牌返回 None"""
+    auth_header = request.headers.get('Authorization', '')
+    scheme, _, token = auth_header.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        return verify_token(token)
+    except ValueError:
+        return None
+
+def generate_csrf_nonce() -> str:
+    """生成每个会话的 CSRF 随机数，通过 cookie 下发"""
+    return os.urandom(16).hex()
+
+def _csrf_signature(nonce: str, timestamp: str, secret) -> str:
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    message = f'{nonce}:{timestamp}'.encode('utf-8')
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+def generate_csrf_token(nonce: str, secret=None) -> str:
+    """生成无状态 CSRF 令牌：随机数加时间戳的 HMAC 签名，无需服务端存储"""
+    timestamp = str(int(time.time()))
+    return f'{timestamp}.{_csrf_signature(nonce, timestamp, secret or CSRF_SECRET_KEY)}'
 
-def verify_csrf_token(token: str, stored_token: str) -> bool:
-    """验证 CSRF 令牌"""
-    return token == stored_token
+def verify_csrf_token(token: str, nonce: str, secret=None,
+                      max_age: int = CSRF_TOKEN_MAX_AGE) -> bool:
+    """验证 CSRF 令牌，签名比较使用常量时间"""
+    if not token or not nonce:
+        return False
+    timestamp, _, signature = token.partition('.')
+    # 令牌来自客户端：isdigit() 接受 '²' 等 int() 无法解析的字符，这里只接受 ASCII 数字
+    if not (timestamp.isascii() and timestamp.isdigit()) or time.time() - int(timestamp) > max_age:
+        return False
+    expected = _csrf_signature(nonce, timestamp, secret or CSRF_SECRET_KEY)
+    # 按字节比较，非 ASCII 的签名不会让 compare_digest 抛出 TypeError
+    return hmac.compare_digest(signature.encode('utf-8'), expected.encode('utf-8'))
+
+# 限流检查结果：是否允许、配额上限、剩余次数、距离配额恢复的秒数
+RateLimitResult = namedtuple('RateLimitResult', 'allowed limit remaining reset')
 
 class RateLimiter:
     """请求频率限制器"""
@@ -94,6 +147,10 @@ class RateLimiter:
         
     def is_allowed(self, key: str) -> bool:
         """检查请求是否允许"""
+        return self.check(key).allowed
+
+    def check(self, key: str) -> RateLimitResult:
+        """检查并记录一次请求，返回配额信息"""
         now = time.time()
         if key not in self.requests:
             self.requests[key] = []
@@ -101,8 +158,240 @@ class RateLimiter:
         # 清理过期的请求记录
         self.requests[key] = [t for t in self.requests[key] if now - t < self.time_window]
         
-        if len(self.requests[key]) >= self.max_requests:
-            return False
-            
-        self.requests[key].append(now)
-        return True 
\ No newline at end of file
+        allowed = len(self.requests[key]) < self.max_requests
+        if allowed:
+            self.requests[key].append(now)
+        reset = self.requests[key][0] + self.time_window - now if self.requests[key] else 0
+        return RateLimitResult(allowed, self.max_requests,
+                               self.max_requests - len(self.requests[key]), reset)
+
+def _window_count(window, prev_count, count, current_window):
+    """滚动到当前窗口，返回 (上一窗口计数, 当前窗口计数)"""
+    if window == current_window:
+        return prev_count, count
+    if window == current_window - 1:
+        return count, 0
+    return 0, 0
+
+def _sliding_estimate(now, time_window, prev_count, count):
+    """滑动窗口计数近似：上一窗口按剩余比例加权"""
+    elapsed = now % time_window
+    return prev_count * (1 - elapsed / time_window) + count
+
+def _sliding_result(now, time_window, max_requests, prev_count, count, allowed):
+    """根据滑动窗口计数生成限流结果"""
+    elapsed = now % time_window
+    estimate = _sliding_estimate(now, time_window, prev_count, count)
+    remaining = max(0, int(max_requests - estimate))
+    if count >= max_requests:
+        # 需要等到下一个窗口，且本窗口计数衰减到上限以下
+        reset = time_window - elapsed + time_window * (1 - max_requests / count)
+    elif prev_count:
+        reset = max(0.0, time_window * (1 - (max_requests - count) / prev_count) - elapsed)
+    else:
+        reset = 0.0
+    return RateLimitResult(allowed, max_requests, remaining, reset)
+
+logger = logging.getLogger('wframe.security')
+
+def _key_hash(key: str) -> int:
+    """跨进程稳定的 64 位键哈希（0 保留给空槽）"""
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+class SharedMemoryRateLimiter:
+    """基于共享内存的跨进程请求频率限制器
+
+    计数存放在固定大小的 mmap 哈希表中，同一主机上的所有 worker 进程共享同一份计数。
+    文件名包含 name、namespace（默认为当前工作目录）和用户 ID，不同应用使用同名限流器时互不影响；
+    文件在进程重启后保留，布局（段数、槽数、时间窗口）变化时整体替换为新文件，计数清零。
+
+    哈希表分为若干段，每段由进程内线程锁加 fcntl 字节范围锁保护，计数采用滑动窗口近似算法。
+    每段有 slots // stripes 个槽，可同时跟踪约 slots 个键（默认 4096）；段满时淘汰窗口最旧的条目，
+    淘汰仍在计数窗口内的条目会让该键的限流失效，此时计入 live_evictions 并记录警告，需要增大 slots。
+    """
+    MAGIC = b'WFRLSHM1'
+    HEADER = struct.Struct('<8sIId')  # magic, 段数, 每段槽数, 时间窗口
+    SLOT = struct.Struct('<QqII')     # 键哈希, 窗口序号, 上一窗口计数, 当前窗口计数
+
+    def __init__(self, max_requests: int, time_window: int, name: str = 'default',
+                 path: str = None, slots: int = 4096, stripes: int = 64, namespace: str = None):
+        if fcntl is None:
+            raise RuntimeError('当前平台不支持共享内存限流，请使用 SQLiteRateLimiter')
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.stripes = stripes
+        self.slots_per_stripe = max(1, slots // stripes)
+        if path is None:
+            namespace = hashlib.blake2b((namespace or os.getcwd()).encode('utf-8'), digest_size=6).hexdigest()
+            path = os.path.join(tempfile.gettempdir(), f'wframe-ratelimit-{os.getuid()}-{namespace}-{name}')
+        self.path = path
+        self.stripe_size = self.slots_per_stripe * self.SLOT.size
+        self.size = self.HEADER.size + self.stripes * self.stripe_size
+        self.live_evictions = 0
+        self._last_eviction_warning = 0.0
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        self._header = self.HEADER.pack(self.MAGIC, self.stripes, self.slots_per_stripe, float(self.time_window))
+        self._fd, self._mmap = self._open()
+
+    def _open(self):
+        """打开并映射共享内存文件，返回 (文件描述符, mmap)"""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                mapped = self._map(fd)
+            except BaseException:
+                os.close(fd)
+                raise
+            if mapped is not None:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+                return fd, mapped
+            os.close(fd)
+
+    def _map(self, fd):
+        """持有文件锁时调用：新文件写入表头，布局不一致时替换文件；需要重新打开时返回 None"""
+        stat = os.fstat(fd)
+        try:
+            if os.stat(self.path).st_ino != stat.st_ino:
+                return None  # 等待锁期间文件已被其他进程替换
+        except FileNotFoundError:
+            return None
+        if stat.st_size == 0:
+            os.ftruncate(fd, self.size)
+            os.pwrite(fd, self._header, 0)
+        elif stat.st_size != self.size or os.pread(fd, self.HEADER.size, 0) != self._header:
+            # 写好新文件后原子替换，仍在运行的旧进程继续使用各自映射的旧文件，不会按错误的布局读写
+            logger.warning('共享内存文件 %s 的布局与当前配置不一致，重新创建', self.path)
+            new_fd, new_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                                dir=os.path.dirname(self.path))
+            try:
+                os.ftruncate(new_fd, self.size)
+                os.pwrite(new_fd, self._header, 0)
+            finally:
+                os.close(new_fd)
+            os.replace(new_path, self.path)
+            return None
+        return mmap.mmap(fd, self.size)
+
+    def is_allowed(self, key: str) -> bool:
+        """检查请求是否允许"""
+        return self.check(key).allowed
+
+    def check(self, key: str) -> RateLimitResult:
+        """检查并记录一次请求，返回配额信息"""
+        now = time.time()
+        current_window = int(now // self.time_window)
+        key_hash = _key_hash(key)
+        stripe = key_hash % self.stripes
+        base = self.HEADER.size + stripe * self.stripe_size
+
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.stripe_size, base)
+            try:
+                offset = self._find_slot(base, key_hash, current_window)
+                slot_hash, window, prev_count, count = self.SLOT.unpack_from(self._mmap, offset)
+                if slot_hash != key_hash:
+                    window, prev_count, count = current_window, 0, 0
+                prev_count, count = _window_count(window, prev_count, count, current_window)
+
+                allowed = _sliding_estimate(now, self.time_window, prev_count, count) < self.max_requests
+                if allowed:
+                    count += 1
+                self.SLOT.pack_into(self._mmap, offset, key_hash, current_window, prev_count, count)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.stripe_size, base)
+        return _sliding_result(now, self.time_window, self.max_requests, prev_count, count, allowed)
+
+    def _find_slot(self, base, key_hash, current_window):
+        """线性探测查找键所在槽，找不到时返回空槽或最旧的槽"""
+        start = (key_hash // self.stripes) % self.slots_per_stripe
+        oldest_offset, oldest_window = None, None
+        for i in range(self.slots_per_stripe):
+            offset = base + ((start + i) % self.slots_per_stripe) * self.SLOT.size
+            slot_hash, window, _, _ = self.SLOT.unpack_from(self._mmap, offset)
+            if slot_hash == key_hash or slot_hash == 0:
+                return offset
+            if oldest_window is None or window < oldest_window:
+                oldest_offset, oldest_window = offset, window
+        if oldest_window >= current_window - 1:
+            # 最旧的条目仍参与滑动窗口计数，淘汰后该键的计数从零开始
+            self.live_evictions += 1
+            now = time.monotonic()
+            if now - self._last_eviction_warning >= 60:
+                self._last_eviction_warning = now
+                logger.warning('限流表 %s 已满，淘汰了仍在计数的条目（累计 %d 次），请增大 slots',
+                               self.path, self.live_evictions)
+        return oldest_offset
+
+    def close(self):
+        """释放映射和文件描述符"""
+        self._mmap.close()
+        os.close(self._fd)
+
+class SQLiteRateLimiter:
+    """基于 SQLite 的持久化请求频率限制器
+
+    计数写入 SQLite 文件，进程重启后依然有效，也可在不支持共享内存的平台上跨进程使用。
+    """
+    def __init__(self, max_requests: int, time_window: int, path: str = 'ratelimit.db',
+                 timeout: float = 5.0):
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._calls = 0
+
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            'key TEXT PRIMARY KEY, window INTEGER NOT NULL, '
+            'prev_count INTEGER NOT NULL, count INTEGER NOT NULL)'
+        )
+
+    def _connect(self):
+        """每个线程复用一个连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def is_allowed(self, key: str) -> bool:
+        """检查请求是否允许"""
+        return self.check(key).allowed
+
+    def check(self, key: str) -> RateLimitResult:
+        """检查并记录一次请求，返回配额信息"""
+        now = time.time()
+        current_window = int(now // self.time_window)
+        conn = self._connect()
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT window, prev_count, count FROM rate_limits WHERE key = ?', (key,)
+            ).fetchone()
+            prev_count, count = _window_count(*(row or (current_window, 0, 0)), current_window)
+
+            allowed = _sliding_estimate(now, self.time_window, prev_count, count) < self.max_requests
+            if allowed:
+                count += 1
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limits (key, window, prev_count, count) '
+                'VALUES (?, ?, ?, ?)',
+                (key, current_window, prev_count, count)
+            )
+
+            # 定期清理已过期的计数
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                conn.execute('DELETE FROM rate_limits WHERE window < ?', (current_window - 1,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return _sliding_result(now, self.time_window, self.max_requests, prev_count, count, allowed)
@@ -22,6 +22,12 @@ setup(
         "alembic>=1.7.0",
         "click>=8.1.7"
     ],
+    extras_require={
+        "async": ["greenlet>=1.0", "aiosqlite>=0.17.0"],
+        "json": ["orjson>=3.6"],
+        "msgpack": ["msgpack>=1.0"],
+        "cbor": ["cbor2>=5.4"]
+    },
     entry_points={
         "console_scripts": [
             "wframe=wframe.cli:main"
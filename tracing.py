@@ -0,0 +1,232 @@
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+try:
+    from .accesslog import AccessLogger
+except ImportError:
+    from accesslog import AccessLogger
+
+_current_span = contextvars.ContextVar('wframe_span', default=None)
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+def parse_traceparent(value):
+    """解析 W3C traceparent，返回 (trace_id, parent_id, sampled) 或 None"""
+    match = _TRACEPARENT.match((value or '').strip().lower())
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+def _new_span_id():
+    return os.urandom(8).hex()
+
+class _NullSpan:
+    """未采样请求使用的空 span，所有操作都是空操作"""
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def child(self, name, **attributes):
+        return self
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    """一个计时区间，用 with 语句时成为当前 span，其中创建的 span 自动成为子 span"""
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'duration', 'attributes', '_t0', '_token')
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes or {}
+        self._t0 = time.perf_counter()
+        self._token = None
+        trace.opened()
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def child(self, name, **attributes):
+        """创建子 span，不改变当前 span"""
+        return Span(self.trace, name, self.span_id, attributes)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._t0
+            self.trace.finished(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attributes['error'] = repr(exc)
+        _current_span.reset(self._token)
+        self.finish()
+        return False
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'attributes': self.attributes,
+        }
+
+class _Trace:
+    """同一请求的全部 span，全部结束后一次性导出"""
+    def __init__(self, tracer, trace_id):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.spans = []
+        self.open = 0
+        self._lock = threading.Lock()
+
+    def opened(self):
+        with self._lock:
+            self.open += 1
+
+    def finished(self, span):
+        with self._lock:
+            self.spans.append(span)
+            self.open -= 1
+            done = self.open == 0
+        if done and self.tracer.exporter is not None:
+            self.tracer.exporter.export([span.to_dict() for span in self.spans])
+
+class Tracer:
+    """请求级追踪
+
+    请求开始时做头部采样：带 traceparent 的请求沿用上游的采样标志，否则按 sample_rate 随机采样；
+    未采样的请求只生成 trace_id，span 全部是空操作。
+    """
+    def __init__(self, sample_rate=0.0, exporter=None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def start_request(self, request):
+        """创建请求的根 span 并设为当前 span，返回 (根 span, 用于 detach 的令牌)"""
+        parent = parse_traceparent(request.headers.get('traceparent'))
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        request.trace_id = trace_id
+        if not sampled:
+            return NULL_SPAN, None
+        root = Span(_Trace(self, trace_id), 'request', parent_id, {
+            'method': request.method,
+            'path': request.path,
+            'request_id': request.request_id,
+        })
+        return root, _current_span.set(root)
+
+    def detach(self, token):
+        if token is not None:
+            _current_span.reset(token)
+
+    def current_span(self):
+        return _current_span.get() or NULL_SPAN
+
+    def span(self, name, **attributes):
+        """在当前 span 下创建子 span，请求未采样时返回空 span"""
+        parent = _current_span.get()
+        if parent is None:
+            return NULL_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    def instrument_sqlalchemy(self):
+        """为所有引擎的 SQL 语句创建 db.query span
+
+        span 保存在本次执行的 context 上而不是连接上，连接归还连接池后不会残留，
+        也不会被之后使用同一连接的请求取到；语句失败时在 handle_error 中记录错误并结束 span。
+        """
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        @event.listens_for(Engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if context is None:
+                return
+            span = self.span('db.query', statement=statement[:500])
+            if span is not NULL_SPAN:
+                context._wframe_span = span
+
+        @event.listens_for(Engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            span = getattr(context, '_wframe_span', None)
+            if span is not None:
+                context._wframe_span = None
+                span.finish()
+
+        @event.listens_for(Engine, 'handle_error')
+        def handle_error(exception_context):
+            context = exception_context.execution_context
+            span = getattr(context, '_wframe_span', None)
+            if span is not None:
+                context._wframe_span = None
+                span.set_attribute('error', repr(exception_context.original_exception))
+                span.finish()
+
+        return self
+
+class RingBufferExporter:
+    """在内存中保留最近的 maxlen 条追踪"""
+    def __init__(self, maxlen=1000):
+        self.buffer = deque(maxlen=maxlen)
+
+    def export(self, spans):
+        self.buffer.append(spans)
+
+    def traces(self, limit=None, trace_id=None):
+        """按时间倒序返回追踪，每条为 span 字典列表"""
+        traces = list(self.buffer)
+        traces.reverse()
+        if trace_id is not None:
+            traces = [spans for spans in traces if spans and spans[0]['trace_id'] == trace_id]
+        return traces[:limit] if limit else traces
+
+class JSONLExporter(AccessLogger):
+    """由后台线程把 span 批量写入 JSON 行文件，队列满时丢弃"""
+    def __init__(self, path, **options):
+        super().__init__(path=path, **options)
+
+    def export(self, spans):
+        for span in spans:
+            self.log(span)
+
+    def format(self, record):
+        return json.dumps(record, ensure_ascii=False, default=str)
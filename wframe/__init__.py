@@ -1,4 +1,5 @@
 from .framework import WebFramework, Response
+from .serialization import JSONResponse
 from .security import token_required
 from .models import User, get_db
 
@@ -0,0 +1,125 @@
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+_STOP = object()
+
+class AccessLogger:
+    """异步结构化访问日志
+
+    请求线程只把记录放入有界队列，后台线程批量序列化为 JSON 行写入文件或 stderr。
+    队列满时直接丢弃并计数，不阻塞请求；队列积压超过 sample_above 时按 sample_rate 采样，
+    5xx 响应始终记录。
+    """
+    def __init__(self, path=None, stream=None, maxsize=10000, batch_size=256,
+                 flush_interval=0.5, sample_rate=1.0, sample_above=None):
+        self.path = path
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.sample_above = maxsize // 2 if sample_above is None else sample_above
+        self.queue = queue.Queue(maxsize)
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name='wframe-access-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, record):
+        """提交一条记录，从不阻塞"""
+        if (record.get('status', 0) < 500 and self.sample_rate < 1.0
+                and self.queue.qsize() >= self.sample_above and random.random() >= self.sample_rate):
+            self.sampled_out += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def log_request(self, request, response, duration):
+        """根据请求和响应生成访问日志记录"""
+        self.log({
+            'time': time.time(),
+            'request_id': request.request_id,
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'bytes': response.content_length,
+            'duration': duration,
+            'remote_addr': request.remote_addr,
+        })
+
+    def _output(self):
+        if self.path is not None:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            return self._file
+        return self.stream or sys.stderr
+
+    def format(self, record):
+        """把记录格式化为一行 JSON，在后台线程中执行"""
+        record['time'] = datetime.fromtimestamp(record['time'], timezone.utc).isoformat()
+        record['duration'] = round(record['duration'] * 1000, 3)  # 毫秒
+        return json.dumps(record, ensure_ascii=False)
+
+    def _write(self, batch):
+        lines = [self.format(record) for record in batch]
+        output = self._output()
+        output.write('\n'.join(lines) + '\n')
+        output.flush()
+        self.written += len(batch)
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            stop = record is _STOP
+            if not stop:
+                batch.append(record)
+            while len(batch) < self.batch_size and not stop:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                else:
+                    batch.append(record)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.dropped += len(batch)
+            if stop:
+                return
+
+    def stats(self):
+        """写入、丢弃和采样计数"""
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+        }
+
+    def close(self, timeout=5.0):
+        """写完队列中的记录后停止后台线程"""
+        if not self._thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
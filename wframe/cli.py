@@ -1,8 +1,26 @@
 import os
+import sys
+import csv
+import json
+import time
+import random
+import socket
+import asyncio
+import tempfile
+import itertools
+import importlib
+import subprocess
 import click
+from collections import Counter
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from marshmallow import Schema, fields
 
+# bcrypt 哈希前缀，导入时带这些前缀的密码视为已哈希
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
 @click.group()
 def main():
     """WFrame - 一个轻量级的 Python Web 框架"""
@@ -121,5 +139,441 @@ def run():
     
     os.system('python app.py')
 
+def _load(name):
+    """加载框架模块，兼容打包后的 wframe 包和源码目录两种布局"""
+    if __package__:
+        return importlib.import_module(f'.{name}', __package__)
+    return importlib.import_module(name)
+
+def _hash_password(password):
+    """在进程池中执行的 bcrypt 哈希"""
+    return _load('security').hash_password(password)
+
+def _read_rows(source, fmt):
+    """逐行读取 CSV 或 NDJSON，不整体加载文件"""
+    if fmt == 'csv':
+        yield from csv.DictReader(source)
+    else:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+def _guess_format(name, fmt):
+    if fmt:
+        return fmt
+    return 'ndjson' if str(name).endswith(('.ndjson', '.jsonl')) else 'csv'
+
+def _insert_statement(models, engine, skip_existing):
+    """构造批量插入语句，skip_existing 时忽略用户名或邮箱冲突的行"""
+    table = models.User.__table__
+    if not skip_existing:
+        return table.insert()
+    if engine.dialect.name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    raise click.UsageError(f'{engine.dialect.name} 不支持 --skip-existing')
+
+@main.group()
+def users():
+    """批量导入、导出用户"""
+    pass
+
+@users.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='默认按文件扩展名判断')
+@click.option('--database-url', envvar='DATABASE_URL', help='默认读取 DATABASE_URL')
+@click.option('--batch-size', default=1000, show_default=True, help='每个事务插入的行数')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='哈希密码的进程数')
+@click.option('--skip-existing', is_flag=True, help='跳过用户名或邮箱已存在的行')
+@click.option('--keep-ids', is_flag=True, help='使用文件中的 id 列（例如导入 export 的输出）')
+def import_users(source, fmt, database_url, batch_size, workers, skip_existing, keep_ids):
+    """从 CSV/NDJSON 流式导入用户
+
+    每行需要 username，以及 password（明文，导入时哈希）或 password_hash（bcrypt 哈希），
+    两者都为空的行会被跳过；created_at 列存在时按 ISO 格式读取，否则使用导入时间。
+    """
+    models = _load('models')
+    engine = models.create_db_engine(database_url)
+    models.Base.metadata.create_all(engine)
+    insert = _insert_statement(models, engine, skip_existing)
+    rows = _read_rows(source, _guess_format(source.name, fmt))
+
+    total = skipped = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+
+            # 没有密码的行不导入，不能为空字符串生成哈希
+            passwords = [row.get('password_hash') or row.get('password') for row in batch]
+            kept = [(row, p) for row, p in zip(batch, passwords) if p]
+            skipped += len(batch) - len(kept)
+            if not kept:
+                continue
+            batch = [row for row, _ in kept]
+            passwords = [p for _, p in kept]
+
+            # 明文密码在进程池中并行哈希，已哈希的值原样使用
+            plain = [i for i, p in enumerate(passwords) if not p.startswith(BCRYPT_PREFIXES)]
+            hashed = pool.map(_hash_password, [passwords[i] for i in plain],
+                              chunksize=max(1, len(plain) // (workers * 4)))
+            for i, value in zip(plain, hashed):
+                passwords[i] = value
+
+            now = datetime.utcnow()
+            values = []
+            for row, password in zip(batch, passwords):
+                created_at = row.get('created_at')
+                value = {
+                    'username': row['username'],
+                    'password': password,
+                    'email': row.get('email') or None,
+                    'is_active': str(row.get('is_active', True)).lower() not in ('0', 'false', ''),
+                    'created_at': datetime.fromisoformat(created_at) if created_at else now,
+                    'updated_at': now,
+                }
+                if keep_ids:
+                    value['id'] = int(row['id'])
+                values.append(value)
+            with engine.begin() as conn:
+                conn.execute(insert, values)
+
+            total += len(batch)
+            elapsed = time.perf_counter() - start
+            click.echo(f'已导入 {total} 行，{total / elapsed:,.0f} 行/秒', err=True)
+
+    if keep_ids and engine.dialect.name == 'postgresql':
+        # 显式写入 id 不会推进序列，把序列移到最大 id 之后
+        table = models.User.__table__
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}))"
+            )
+
+    elapsed = time.perf_counter() - start
+    click.echo(f'导入完成：共 {total} 行，用时 {elapsed:.2f} 秒，{total / max(elapsed, 1e-9):,.0f} 行/秒', err=True)
+    if skipped:
+        click.echo(f'跳过 {skipped} 行：缺少 password / password_hash', err=True)
+    engine.dispose()
+
+@users.command('export')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='默认按文件扩展名判断')
+@click.option('--database-url', envvar='DATABASE_URL', help='默认读取 DATABASE_URL')
+@click.option('--batch-size', default=1000, show_default=True, help='每次从游标读取的行数')
+def export_users(output, fmt, database_url, batch_size):
+    """使用服务端游标流式导出用户，密码以 bcrypt 哈希导出"""
+    models = _load('models')
+    engine = models.create_db_engine(database_url)
+    table = models.User.__table__
+    columns = ['id', 'username', 'password_hash', 'email', 'is_active', 'created_at']
+    fmt = _guess_format(output.name, fmt)
+
+    writer = csv.writer(output) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+
+    total = 0
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+            table.select().order_by(table.c.id)
+        )
+        for partition in result.partitions(batch_size):
+            for row in partition:
+                values = [row.id, row.username, row.password, row.email, row.is_active,
+                          row.created_at.isoformat() if row.created_at else None]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    output.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n')
+            total += len(partition)
+
+    elapsed = time.perf_counter() - start
+    click.echo(f'导出完成：共 {total} 行，用时 {elapsed:.2f} 秒，{total / max(elapsed, 1e-9):,.0f} 行/秒', err=True)
+    engine.dispose()
+
+# 默认请求组合，对应示例应用：首页（签发 CSRF 令牌）、问候接口和需要令牌的用户信息接口
+DEFAULT_BENCH_SCENARIO = [
+    {'name': 'index', 'method': 'GET', 'path': '/', 'weight': 1},
+    {'name': 'hello', 'method': 'GET', 'path': '/api/hello/user{n}', 'weight': 4},
+    {'name': 'profile', 'method': 'GET', 'path': '/api/profile', 'weight': 4, 'auth': True},
+]
+
+class _BenchConnection:
+    """最小的 HTTP/1.1 keep-alive 客户端连接，保存服务端设置的 cookie"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+        self.reader = None
+        self.writer = None
+        self.connects = 0
+
+    async def request(self, method, path, headers=None, body=b''):
+        for attempt in range(2):
+            fresh = self.writer is None
+            if fresh:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                self.connects += 1
+            try:
+                return await self._send(method, path, headers or {}, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # 服务端可能已关闭空闲连接，重连重试一次
+                self.close()
+                if fresh or attempt:
+                    raise
+
+    async def _send(self, method, path, headers, body):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Connection: keep-alive']
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        if body:
+            lines.append(f'Content-Length: {len(body)}')
+        lines.extend(f'{k}: {v}' for k, v in headers.items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('连接已关闭')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'set-cookie':
+                cookie_name, _, cookie_value = value.split(';', 1)[0].partition('=')
+                self.cookies[cookie_name.strip()] = cookie_value.strip()
+            response_headers[name] = value
+
+        if 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            data = b''.join(chunks)
+        else:
+            data = await self.reader.read()
+            self.close()
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def _summarize(samples, elapsed):
+    """samples 为 [(耗时秒, 状态码)]，状态码 0 表示连接错误"""
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = Counter(status for _, status in samples)
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 400)
+    return {
+        'requests': len(samples),
+        'rps': len(samples) / elapsed if elapsed else 0.0,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'status': {str(code): count for code, count in sorted(statuses.items())},
+        **{f'p{label}_ms': _percentile(latencies, p) * 1000
+           for label, p in (('50', 0.5), ('90', 0.9), ('99', 0.99), ('999', 0.999))},
+    }
+
+async def _bench_setup(host, port, username, password, register=False):
+    """执行示例应用的登录流程：获取 CSRF 令牌和 cookie，再登录取得访问令牌
+
+    register 为 True 且登录返回 401 时（例如以 --app 导入启动、未创建初始用户的新数据库），
+    先通过 /api/users 注册该用户再重新登录。
+    """
+    conn = _BenchConnection(host, port)
+    context = {'csrf': '', 'token': ''}
+    try:
+        status, _, body = await conn.request('GET', '/')
+        if status == 200:
+            context['csrf'] = json.loads(body or b'{}').get('csrf_token', '')
+        if username:
+            headers = {'Content-Type': 'application/json', 'X-CSRF-Token': context['csrf']}
+            payload = json.dumps({'username': username, 'password': password}).encode('utf-8')
+            status, _, body = await conn.request('POST', '/api/login', headers, payload)
+            if status == 401 and register:
+                created, _, _ = await conn.request('POST', '/api/users', headers, payload)
+                if created == 200:
+                    click.echo(f'已创建压测用户 {username}', err=True)
+                    status, _, body = await conn.request('POST', '/api/login', headers, payload)
+            if status == 200:
+                context['token'] = json.loads(body).get('access_token', '')
+            else:
+                click.echo(f'警告：登录失败（HTTP {status}）', err=True)
+        context['cookies'] = dict(conn.cookies)
+    finally:
+        conn.close()
+    return context
+
+async def _bench_worker(host, port, scenario, context, deadline, remaining, samples, connects):
+    conn = _BenchConnection(host, port)
+    conn.cookies.update(context.get('cookies', {}))
+    weights = [item.get('weight', 1) for item in scenario]
+    rng = random.Random()
+    try:
+        while time.perf_counter() < deadline and (remaining is None or remaining[0] > 0):
+            if remaining is not None:
+                remaining[0] -= 1
+            item = rng.choices(scenario, weights)[0]
+            method = item.get('method', 'GET').upper()
+            path = item['path'].format(n=rng.randrange(1000), **context)
+            headers = dict(item.get('headers', {}))
+            body = b''
+            if item.get('auth') and context['token']:
+                headers['Authorization'] = f'Bearer {context["token"]}'
+            if method not in ('GET', 'HEAD') and context['csrf']:
+                headers['X-CSRF-Token'] = context['csrf']
+            if 'json' in item:
+                body = json.dumps(item['json']).replace('{n}', str(rng.randrange(10 ** 9))).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            start = time.perf_counter()
+            try:
+                status, _, _ = await conn.request(method, path, headers, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                conn.close()
+                status = 0
+            samples.append((item.get('name', path), time.perf_counter() - start, status))
+    finally:
+        conn.close()
+        connects.append(conn.connects)
+
+async def _bench_run(host, port, scenario, connections, duration, total, username, password):
+    default_scenario = scenario is DEFAULT_BENCH_SCENARIO
+    context = await _bench_setup(host, port, username, password, register=default_scenario)
+    if default_scenario and not context['token']:
+        # 默认组合中需要令牌的请求没有令牌只会得到 401，不计入结果
+        scenario = [item for item in scenario if not item.get('auth')]
+        click.echo('未取得访问令牌，默认请求组合中跳过需要令牌的请求', err=True)
+    elif username and not context['token']:
+        click.echo('未取得访问令牌，需要令牌的请求将返回错误', err=True)
+    samples = []
+    connects = []
+    remaining = [total] if total else None
+    start = time.perf_counter()
+    deadline = start + (duration if not total else float('inf'))
+    await asyncio.gather(*(
+        _bench_worker(host, port, scenario, context, deadline, remaining, samples, connects)
+        for _ in range(connections)
+    ))
+    elapsed = time.perf_counter() - start
+    routes = {}
+    for name, latency, status in samples:
+        routes.setdefault(name, []).append((latency, status))
+    return {
+        'connections': connections,
+        'tcp_connects': sum(connects),
+        'duration': elapsed,
+        'total': _summarize([(latency, status) for _, latency, status in samples], elapsed),
+        'routes': {name: _summarize(route_samples, elapsed) for name, route_samples in sorted(routes.items())},
+    }
+
+def _start_app(target, host, port, server):
+    """在子进程中启动应用，返回进程对象
+
+    werkzeug 开发服务器每个响应后都会关闭连接，测量 keep-alive 时使用 waitress。
+    """
+    module, _, attr = target.partition(':')
+    if server == 'waitress':
+        serve = f'from waitress import serve\nserve(app, host={host!r}, port={port}, threads=8, _quiet=True)\n'
+    else:
+        serve = f'from werkzeug.serving import run_simple\nrun_simple({host!r}, {port}, app, threaded=True)\n'
+    code = (
+        'import importlib, sys\n'
+        f'sys.path.insert(0, {os.getcwd()!r})\n'
+        f'app = getattr(importlib.import_module({module!r}), {(attr or "app")!r})\n'
+        + serve
+    )
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=log)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise click.ClickException('应用启动失败:\n' + log.read().decode('utf-8', 'replace')[-2000:])
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise click.ClickException('等待应用启动超时')
+
+def _print_report(report, baseline=None):
+    def row(name, stats, base=None):
+        line = (f'{name:16s} {stats["requests"]:8d} {stats["rps"]:9.1f} {stats["error_rate"] * 100:6.2f}% '
+                f'{stats["p50_ms"]:8.2f} {stats["p90_ms"]:8.2f} {stats["p99_ms"]:8.2f} {stats["p999_ms"]:8.2f}')
+        if base:
+            line += (f'   rps {(stats["rps"] / base["rps"] - 1) * 100:+.1f}%'
+                     f' p99 {(stats["p99_ms"] / base["p99_ms"] - 1) * 100:+.1f}%' if base['rps'] and base['p99_ms'] else '')
+        click.echo(line)
+
+    click.echo(f'{report["connections"]} 个连接（共建立 {report["tcp_connects"]} 次 TCP 连接），'
+               f'用时 {report["duration"]:.2f} 秒')
+    click.echo(f'{"路由":14s} {"请求数":>6s} {"请求/秒":>7s} {"错误率":>5s} '
+               f'{"p50 ms":>8s} {"p90 ms":>8s} {"p99 ms":>8s} {"p999 ms":>8s}')
+    for name, stats in report['routes'].items():
+        row(name, stats, baseline and baseline['routes'].get(name))
+    row('合计', report['total'], baseline and baseline['total'])
+    click.echo('状态码: ' + ', '.join(f'{code}={count}' for code, count in report['total']['status'].items()))
+
+@main.command()
+@click.argument('url', default='http://127.0.0.1:5000')
+@click.option('--app', 'target', help='先在子进程中启动应用，例如 app:app，此时 URL 只取主机和端口')
+@click.option('--server', type=click.Choice(['werkzeug', 'waitress']), default='werkzeug', show_default=True,
+              help='--app 使用的服务器，werkzeug 不支持 keep-alive')
+@click.option('-c', '--connections', default=10, show_default=True, help='并发 keep-alive 连接数')
+@click.option('-d', '--duration', default=10.0, show_default=True, help='压测时长（秒）')
+@click.option('-n', '--requests', 'total', type=int, help='总请求数，指定后忽略 --duration')
+@click.option('--scenario', type=click.File('r', encoding='utf-8'),
+              help='请求组合 JSON 文件：[{"name", "method", "path", "weight", "auth", "json", "headers"}]')
+@click.option('--username', default='admin', show_default=True, help='登录流程使用的用户名，为空时跳过登录')
+@click.option('--password', default='admin123', show_default=True)
+@click.option('--json', 'json_output', type=click.File('w', encoding='utf-8'), help='把结果写入 JSON 文件')
+@click.option('--compare', type=click.File('r', encoding='utf-8'), help='与之前保存的 JSON 结果比较')
+def bench(url, target, server, connections, duration, total, scenario, username, password, json_output, compare):
+    """对应用进行 HTTP 压测
+
+    先访问首页获取 CSRF 令牌和 cookie 并登录取得访问令牌，然后用多个 keep-alive 连接
+    按权重发送请求，路径中的 {n}、{token}、{csrf} 会被替换。
+    """
+    parts = urlsplit(url)
+    host, port = parts.hostname or '127.0.0.1', parts.port or 80
+    scenario = json.load(scenario) if scenario else DEFAULT_BENCH_SCENARIO
+    baseline = json.load(compare) if compare else None
+
+    process = _start_app(target, host, port, server) if target else None
+    try:
+        report = asyncio.run(_bench_run(host, port, scenario, connections, duration, total, username, password))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    _print_report(report, baseline)
+    if json_output:
+        json.dump(report, json_output, indent=2, ensure_ascii=False)
+
 if __name__ == '__main__':
     main() 
\ No newline at end of file
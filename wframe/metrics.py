@@ -0,0 +1,276 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+# 固定的对数刻度延迟桶：0.25ms 起每级翻倍，最大约 16 秒
+DEFAULT_BUCKETS = tuple(0.00025 * 2 ** i for i in range(17))
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def _merge(totals, shard):
+    """把分片的值累加到 totals"""
+    for key, value in dict(shard).items():
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+class _ShardOwner:
+    """放在线程本地存储中，线程退出时被回收，用于触发分片归并"""
+    __slots__ = ('__weakref__',)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """指标基类，值保存在注册表的线程分片中"""
+    type = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+        return (self.name, tuple((name, str(labels[name])) for name in self.labelnames))
+
+class Counter(_Metric):
+    """只增计数器"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """可增可减的量，多线程、多进程的值相加"""
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """固定分桶直方图"""
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self.registry._shard()
+        key = self._key(labels)
+        data = shard.get(key)
+        if data is None:
+            # 各桶计数（非累计）、总和、次数
+            data = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+class MetricsRegistry:
+    """指标注册表
+
+    每个线程写自己的分片字典，记录时无需加锁，采集时再汇总所有分片；
+    线程退出后它的分片并入 _retired 并从列表中移除，分片数不随线程的创建和退出增长。
+    设置 multiprocess_dir 后，每个进程定期把本进程的汇总值写入该目录下的文件，
+    采集时合并所有进程的文件，预派生的多个 worker 可以由任意一个返回全局数据；
+    已退出进程的计数器和直方图保留，仪表值丢弃。
+    """
+    def __init__(self, multiprocess_dir=None, flush_interval=1.0):
+        self.metrics = {}
+        self.callbacks = []
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # 子进程从零开始计数，避免重复统计父进程的值
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._shards = []
+        self._retired = {}
+        self._local = threading.local()
+        # 分片归并可能在任意线程回收对象时触发，使用可重入锁
+        self._lock = threading.RLock()
+        self._flusher = None
+        self._flusher_pid = None
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(owner, self._retire, shard, self._shards).atexit = False
+            self._ensure_flusher()
+        return shard
+
+    def _retire(self, shard, shards):
+        """线程退出后把它的分片并入 _retired"""
+        with self._lock:
+            if shards is not self._shards:
+                return  # fork 后已经重置
+            # 生成新字典而不是原地修改，采集时在锁内取得的引用保持不变
+            self._retired = _merge(_merge({}, self._retired), shard)
+            shards.remove(shard)
+
+    def _register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def register_callback(self, name, help, fn, type='gauge'):
+        """注册采集时调用的指标，fn 返回数值或 {标签元组: 数值}"""
+        self.callbacks.append((name, help, type, fn))
+
+    def collect_local(self):
+        """汇总本进程所有线程分片"""
+        with self._lock:
+            shards = list(self._shards)
+            retired = self._retired
+        totals = _merge({}, retired)
+        for shard in shards:
+            _merge(totals, shard)
+        return totals
+
+    # 多进程聚合
+
+    def _ensure_flusher(self):
+        if not self.multiprocess_dir or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name='wframe-metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _process_file(self, pid):
+        return os.path.join(self.multiprocess_dir, f'metrics-{pid}.json')
+
+    def flush(self):
+        """把本进程的汇总值原子写入共享目录"""
+        if not self.multiprocess_dir:
+            return
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        data = [[name, labels, value] for (name, labels), value in self.collect_local().items()]
+        fd, tmp = tempfile.mkstemp(dir=self.multiprocess_dir, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self._process_file(os.getpid()))
+
+    def collect(self):
+        """汇总所有进程的指标值"""
+        if not self.multiprocess_dir:
+            return self.collect_local()
+        self.flush()
+        totals = {}
+        for filename in os.listdir(self.multiprocess_dir):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            pid = int(filename[len('metrics-'):-len('.json')])
+            try:
+                with open(os.path.join(self.multiprocess_dir, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(pid)
+            for name, labels, value in data:
+                metric = self.metrics.get(name)
+                if metric is not None and metric.type == 'gauge' and not alive:
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                if isinstance(value, list):
+                    current = totals.get(key)
+                    totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        """生成 Prometheus 文本格式"""
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in sorted(by_name.get(name, [])):
+                if metric.type != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = ('le', _format_value(bound) if bound == float('inf') else repr(bound))
+                    lines.append(f'{name}_bucket{_format_labels(labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+
+        for name, help, type, fn in self.callbacks:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            value = fn()
+            if isinstance(value, dict):
+                for labels, item in sorted(value.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(item)}')
+            else:
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,125 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+class SamplingProfiler:
+    """运行时可开关的采样分析器
+
+    开启后后台线程按 interval 秒采样所有正在处理请求的线程的调用栈，
+    按路由汇总，停止时为每个路由写出 collapsed stack 文件（flamegraph.pl、speedscope 可直接读取）。
+    关闭时不注册任何请求回调，没有额外开销。
+    """
+    def __init__(self, app, interval=0.005, output_dir='profiles', max_depth=128):
+        self.app = app
+        self.interval = interval
+        self.output_dir = output_dir
+        self.max_depth = max_depth
+        self.running = False
+        self.samples = {}   # 路由 -> {折叠调用栈: 次数}
+        self.active = {}    # 线程 ID -> 路由
+        self.started_at = None
+        self.sample_count = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        # 保护 samples：采样线程写入时 status() 可能正在读取
+        self._samples_lock = threading.Lock()
+
+    def _enter(self, request):
+        self.active[threading.get_ident()] = request.endpoint or '<unmatched>'
+
+    def _exit(self, request, response):
+        self.active.pop(threading.get_ident(), None)
+        return response
+
+    def start(self):
+        """开始采样"""
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+            self.samples = {}
+            self.active = {}
+            self.sample_count = 0
+            self.started_at = time.time()
+            # 替换为新的列表而不是原地修改，正在遍历回调列表的请求不会跳过其他回调
+            self.app.before_request_funcs = self.app.before_request_funcs + [self._enter]
+            self.app.after_request_funcs = self.app.after_request_funcs + [self._exit]
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='wframe-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """停止采样并写出结果，返回 {路由: 文件路径}"""
+        with self._lock:
+            if not self.running:
+                return {}
+            self.running = False
+            self.app.before_request_funcs = [f for f in self.app.before_request_funcs if f != self._enter]
+            self.app.after_request_funcs = [f for f in self.app.after_request_funcs if f != self._exit]
+            self._stop_event.set()
+            self._thread.join()
+            self.active = {}
+            return self.write()
+
+    def toggle(self):
+        if self.running:
+            return self.stop()
+        return self.start()
+
+    def install_signal(self, signum=None):
+        """收到信号（默认 SIGUSR2）时切换采样状态，只能在主线程调用"""
+        signum = signum or signal.SIGUSR2
+        # 在新线程中切换，避免信号处理函数里等待锁
+        signal.signal(signum, lambda *args: threading.Thread(target=self.toggle, daemon=True).start())
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            active = dict(self.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            collapsed = [(endpoint, self._collapse(frames[ident])) for ident, endpoint in active.items()
+                         if ident in frames]
+            del frames
+            with self._samples_lock:
+                for endpoint, stack in collapsed:
+                    stacks = self.samples.setdefault(endpoint, {})
+                    stacks[stack] = stacks.get(stack, 0) + 1
+                self.sample_count += len(collapsed)
+
+    def write(self):
+        """把各路由的采样结果写入 output_dir"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))
+        paths = {}
+        for endpoint, stacks in self.samples.items():
+            name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in endpoint)
+            path = os.path.join(self.output_dir, f'{stamp}-{os.getpid()}-{name}.collapsed')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                    f.write(f'{stack} {count}\n')
+            paths[endpoint] = path
+        return paths
+
+    def status(self):
+        with self._samples_lock:
+            routes = {endpoint: sum(stacks.values()) for endpoint, stacks in self.samples.items()}
+            sample_count = self.sample_count
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'samples': sample_count,
+            'routes': routes,
+        }
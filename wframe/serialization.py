@@ -0,0 +1,188 @@
+import json
+import uuid
+from collections.abc import Mapping
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from functools import partial
+
+from marshmallow import Schema, fields, missing
+from werkzeug.wrappers import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+def _default(value):
+    """标准 json 无法处理的常见类型"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f'无法序列化为 JSON 的类型: {type(value).__name__}')
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(data):
+        """把数据编码为 UTF-8 JSON 字节串，安装了 orjson 时使用 orjson"""
+        return orjson.dumps(data, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def dumps(data):
+        """把数据编码为 UTF-8 JSON 字节串，安装了 orjson 时使用 orjson"""
+        return _encoder.encode(data).encode('utf-8')
+
+    loads = json.loads
+
+JSON_MIMETYPE = 'application/json'
+
+# 可协商的数据格式：mimetype -> (编码函数, 解码函数)，JSON 始终可用且排在最前，
+# MessagePack 和 CBOR 在安装了对应的库时启用
+FORMATS = {JSON_MIMETYPE: (dumps, loads)}
+
+if msgpack is not None:
+    FORMATS['application/msgpack'] = FORMATS['application/x-msgpack'] = (
+        partial(msgpack.packb, default=_default, datetime=False),
+        partial(msgpack.unpackb, raw=False),
+    )
+
+if cbor2 is not None:
+    # CBOR 原生支持日期时间，不带时区的 datetime 按 UTC 编码
+    FORMATS['application/cbor'] = (
+        partial(cbor2.dumps, timezone=timezone.utc, default=lambda encoder, value: encoder.encode(_default(value))),
+        cbor2.loads,
+    )
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+def _bind(namespace, value):
+    """把对象放入生成代码的命名空间，返回其变量名"""
+    name = f'_v{len(namespace)}'
+    namespace[name] = value
+    return name
+
+def _converter(field, var, namespace):
+    """返回把变量 var（已确认不是 None）转换为输出值的表达式，无法特化时返回 None"""
+    kind = type(field)
+    if kind is fields.Raw:
+        return var
+    if kind is fields.String:
+        namespace['_text'] = _text
+        return f'({var} if {var}.__class__ is str else _text({var}))'
+    if kind in (fields.Integer, fields.Float) and not field.as_string:
+        return f'{"int" if kind is fields.Integer else "float"}({var})'
+    if kind is fields.Boolean:
+        return f'({var} if {var}.__class__ is bool else {_bind(namespace, field)}._serialize({var}, None, None))'
+    if kind in (fields.DateTime, fields.Date) and field.format in (None, 'iso', 'iso8601'):
+        return f'{var}.isoformat()'
+    if kind is fields.Nested:
+        return f'{_bind(namespace, _NestedDump(field))}({var})'
+    if kind is fields.List:
+        item = f'{var}_'
+        inner = _converter(field.inner, item, namespace)
+        if inner is None:
+            inner = f'{_bind(namespace, field.inner)}._serialize({item}, None, None)'
+        return f'[None if {item} is None else {inner} for {item} in {var}]'
+    if kind is fields.Dict and field.key_field is None and field.value_field is None:
+        return f'dict({var})'
+    return None
+
+class _NestedDump:
+    """Nested 字段的 dump 函数，首次调用时才编译，自引用的 schema 在编译时不会无限递归"""
+    __slots__ = ('field', 'dump')
+
+    def __init__(self, field):
+        self.field = field
+        self.dump = None
+
+    def __call__(self, value):
+        if self.dump is None:
+            schema = self.field.schema
+            if schema.only is None and not schema.exclude:
+                # 没有 only/exclude 时按类复用编译结果，递归的各层共用同一个函数
+                self.dump = compile_schema(type(schema), schema.many)
+            else:
+                self.dump = compile_schema(schema)
+        return self.dump(value)
+
+# 按 schema 类缓存编译结果
+_compiled = {}
+
+def compile_schema(schema, many=None):
+    """把 marshmallow schema 编译为专用的 dump 函数
+
+    字段列表、取值键名和类型转换在编译时确定，调用时不再逐字段检查；
+    常见字段类型直接生成转换表达式，其他字段回退到 field.serialize。
+    带 pre_dump/post_dump 钩子或自定义 get_attribute 的 schema 直接使用 schema.dump。
+    传入 schema 类时编译结果按类缓存，传入实例时每次重新编译（实例可能带 only/exclude）。
+    """
+    if isinstance(schema, type):
+        key = (schema, many)
+        if key not in _compiled:
+            _compiled[key] = compile_schema(schema(), many)
+        return _compiled[key]
+    if many is None:
+        many = schema.many
+    if any(getattr(schema, '_hooks', {}).values()) or type(schema).get_attribute is not Schema.get_attribute:
+        return partial(schema.dump, many=many)
+
+    namespace = {'MISSING': missing, 'Mapping': Mapping, 'partial': partial}
+    lines = [
+        'def dump(obj):',
+        '    get = obj.get if isinstance(obj, Mapping) else partial(getattr, obj)',
+        '    out = {}',
+    ]
+    for field_name, field in schema.dump_fields.items():
+        key = repr(field.data_key if field.data_key is not None else field_name)
+        attribute = field.attribute or field_name
+        expression = None
+        if field._CHECK_ATTRIBUTE and '.' not in attribute:
+            expression = _converter(field, 'v', namespace)
+        name = _bind(namespace, field)
+        if expression is None:
+            lines.append(f'    v = {name}.serialize({field_name!r}, obj)')
+            lines.append(f'    if v is not MISSING: out[{key}] = v')
+            continue
+        lines.append(f'    v = get({attribute!r}, MISSING)')
+        if field.dump_default is not missing:
+            call = '()' if callable(field.dump_default) else ''
+            lines.append(f'    if v is MISSING: v = {name}.dump_default{call}')
+        lines.append('    if v is not MISSING:')
+        lines.append(f'        out[{key}] = None if v is None else {expression}')
+    lines.append('    return out')
+    exec('\n'.join(lines), namespace)
+    dump = namespace['dump']
+    if many:
+        return lambda objs: [dump(obj) for obj in objs]
+    return dump
+
+class JSONResponse(Response):
+    """JSON 响应
+
+    data 为 bytes 时视为已经编码好的 JSON，可以用 dumps 在模块加载时预先编码固定的响应体；
+    指定 schema 时先用编译后的 dump 函数序列化。
+    """
+    default_mimetype = 'application/json'
+
+    def __init__(self, data=None, status=None, headers=None, schema=None, **kwargs):
+        if schema is not None:
+            data = compile_schema(schema)(data)
+        body = data if isinstance(data, bytes) else dumps(data)
+        super().__init__(body, status=status, headers=headers, **kwargs)
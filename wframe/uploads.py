@@ -0,0 +1,119 @@
+import hashlib
+import shutil
+import tempfile
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+class UploadedPart:
+    """multipart 请求中的一个部分
+
+    数据写入 SpooledTemporaryFile，超过 spool_threshold 字节后转存到磁盘；
+    校验和在读取时增量计算。
+    """
+    def __init__(self, name, filename, headers, spool_threshold, hash_algorithm):
+        self.name = name
+        self.filename = filename
+        self.headers = headers
+        self.content_type = headers.get('Content-Type')
+        self.size = 0
+        self.stream = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self._hash = hashlib.new(hash_algorithm)
+
+    def _write(self, data):
+        self.stream.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    @property
+    def is_file(self):
+        return self.filename is not None
+
+    @property
+    def checksum(self):
+        """数据的十六进制摘要（默认 sha256）"""
+        return self._hash.hexdigest()
+
+    @property
+    def value(self):
+        """表单字段的文本值"""
+        self.stream.seek(0)
+        return self.stream.read().decode('utf-8', 'replace')
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def iter_chunks(self, chunk_size=64 * 1024):
+        """分块读取数据，不一次性载入内存"""
+        self.stream.seek(0)
+        while True:
+            chunk = self.stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def save(self, path):
+        """把数据复制到 path"""
+        self.stream.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self.stream, f)
+
+    def close(self):
+        self.stream.close()
+
+class MultipartReader:
+    """流式解析 multipart/form-data 请求体
+
+    按 chunk_size 读取请求体并交给 werkzeug 的 MultipartDecoder，每个部分读取完毕后产出一个
+    UploadedPart。读取过程中检查单个文件（max_part_size）、单个表单字段（max_field_size）、
+    部分数量（max_parts）和请求体总大小（max_total_size），超限时抛出 413。
+    内存占用与请求体大小无关，最多为 chunk_size 加上每个部分的 spool_threshold。
+    """
+    def __init__(self, request, max_part_size=10 * 1024 * 1024, max_field_size=64 * 1024,
+                 max_total_size=100 * 1024 * 1024, max_parts=1000, spool_threshold=512 * 1024,
+                 chunk_size=64 * 1024, hash_algorithm='sha256'):
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            raise BadRequest('请求体不是 multipart/form-data')
+        self.request = request
+        self.boundary = boundary.encode('latin-1')
+        self.max_part_size = max_part_size
+        self.max_field_size = max_field_size
+        self.max_total_size = max_total_size
+        self.max_parts = max_parts
+        self.spool_threshold = spool_threshold
+        self.chunk_size = chunk_size
+        self.hash_algorithm = hash_algorithm
+        self.parts = []
+
+    def __iter__(self):
+        decoder = MultipartDecoder(self.boundary, max_parts=self.max_parts)
+        chunks = self.request.iter_body(self.chunk_size, self.max_total_size)
+        part = None
+        while True:
+            try:
+                event = decoder.next_event()
+            except ValueError:
+                raise BadRequest('multipart 请求体格式错误或不完整') from None
+            if isinstance(event, NeedData):
+                decoder.receive_data(next(chunks, None))
+            elif isinstance(event, (Field, File)):
+                part = UploadedPart(event.name, getattr(event, 'filename', None), event.headers,
+                                    self.spool_threshold, self.hash_algorithm)
+                self.parts.append(part)
+            elif isinstance(event, Data):
+                limit = self.max_part_size if part.is_file else self.max_field_size
+                if part.size + len(event.data) > limit:
+                    raise RequestEntityTooLarge(f'{part.name} 超过 {limit} 字节')
+                part._write(event.data)
+                if not event.more_data:
+                    part.stream.seek(0)
+                    yield part
+            elif isinstance(event, Epilogue):
+                return
+
+    def close(self):
+        """关闭所有部分的临时文件"""
+        for part in self.parts:
+            part.close()
+        self.parts = []